@@ -1,12 +1,18 @@
+import asyncio
+import json
 import os
-from fastapi.responses import FileResponse
+import time
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from libs.batch_search import get_batch_job_file, make_batch_job_id, parse_batch_queries, run_batch_search
 from libs.find_sources import get_query_sources
-from libs.common import project_path
-from fastapi import FastAPI, HTTPException, Header
+from libs.limiter import LimitExceeded, search_limiter
+from libs.index_manifest import get_index_generation
+from libs.query_engine import DRIFT_SEARCH, GLOBAL_SEARCH, LOCAL_SEARCH, aget_project_engine
+from libs.result_cache import make_cache_key, result_cache
+from fastapi import FastAPI, File, Form, HTTPException, Header, UploadFile
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import libs.config as config
-from graphrag.cli.query import run_local_search, run_global_search, run_drift_search
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,64 +45,172 @@ class Item(BaseModel):
     context_data: bool = False
 
 
-local_search_cache = {}
-local_search_cache_limit = 20
+class BatchItem(BaseModel):
+    queries: list[str]
+    project_name: str
+    search_type: str = LOCAL_SEARCH
+    community_level: int = 2
+    dynamic_community_selection: bool = False
+    context_data: bool = False
+    parallelism: int = config.api_batch_parallelism
+    job_id: str = ""
 
 
-def get_local_search_cache(item: Item):
-    if not item.user_cache:
-        return None
-    
-    if item.query in local_search_cache:
-        return local_search_cache[item.query]
-    return None
+def check_api_key(api_key: str):
+    if config.api_key != api_key:
+        raise Exception("Invalid api-key")
 
 
-def set_local_search_cache(item: Item, result: any):
+async def get_search_cache(item: Item, search_type: str, **params):
     if not item.user_cache:
+        return None, None, None
+
+    index_version = await asyncio.to_thread(get_index_generation, item.project_name)
+    await asyncio.to_thread(result_cache.purge_stale, item.project_name, index_version)
+
+    cache_key = make_cache_key(
+        project_name=item.project_name,
+        search_type=search_type,
+        query=item.query,
+        community_level=item.community_level,
+        index_version=index_version,
+        **params,
+    )
+    return cache_key, index_version, await asyncio.to_thread(result_cache.get, cache_key)
+
+
+async def set_search_cache(item: Item, cache_key: str, index_version: str, response: any, context_data: any):
+    if not cache_key:
         return
-    
-    if len(local_search_cache) >= local_search_cache_limit:
-        local_search_cache.pop(list(local_search_cache.keys())[0])
-    local_search_cache[item.query] = result
+
+    await asyncio.to_thread(result_cache.set, cache_key, {
+        "response": response,
+        "context_data": context_data,
+    }, item.project_name, index_version)
+
+
+async def render_result(item: Item, response: any, context_data: any, query_source: bool=False):
+    result = {
+            "message": "ok",
+            "response": response,
+            "query": item.query,
+        }
+
+    if query_source:
+        result['sources'] = await asyncio.to_thread(get_query_sources, item.project_name, context_data)
+
+    if item.context_data:
+        result['context_data'] = context_data
+
+    return result
+
+
+def sse_event(event: str, data: any):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_search(item: Item, search_type: str, search_stream: callable, query_source: bool=False, **params):
+    """Server-sent events: `context` (sources/context data), `token` per chunk, then `done` or `error`."""
+    cache_key, index_version, cached_result = await get_search_cache(item, search_type, **params)
+
+    # checked before the response starts, so a full queue is still a plain 429/503. The slot
+    # itself is taken by the stream, a client gone before it starts never holds one
+    if not cached_result:
+        search_limiter.check(item.project_name)
+
+    async def context_event(context_data: any):
+        data = {"query": item.query}
+        if query_source:
+            data['sources'] = await asyncio.to_thread(get_query_sources, item.project_name, context_data)
+        if item.context_data:
+            data['context_data'] = context_data
+        return sse_event("context", data)
+
+    async def events():
+        started_at = time.time()
+        try:
+            if cached_result:
+                yield await context_event(cached_result['context_data'])
+                yield sse_event("token", cached_result['response'])
+                yield sse_event("done", {
+                    "message": "ok",
+                    "cached": True,
+                    "index_version": index_version,
+                    "elapsed": time.time() - started_at,
+                })
+                return
+
+            async with search_limiter.limit(item.project_name):
+                engine = await aget_project_engine(item.project_name)
+
+                response = ""
+                context_data = None
+                first_token_at = None
+                get_context_data = True
+                async for stream_chunk in search_stream(engine):
+                    if get_context_data:
+                        context_data = stream_chunk
+                        get_context_data = False
+                        yield await context_event(context_data)
+                        continue
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    response += stream_chunk
+                    yield sse_event("token", stream_chunk)
+
+            await set_search_cache(item, cache_key, index_version, response, context_data)
+
+            yield sse_event("done", {
+                "message": "ok",
+                "cached": False,
+                "index_version": engine.generation,
+                "response_chars": len(response),
+                "time_to_first_token": (first_token_at or time.time()) - started_at,
+                "elapsed": time.time() - started_at,
+            })
+        except LimitExceeded as e:
+            yield sse_event("error", {"error": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def limit_exceeded_response(e: LimitExceeded):
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"error": str(e)},
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 
 # -----------------------------------------------------------------
 @app.post("/api/local_search")
-def local_search(item: Item, api_key: str=Header(...)):
+async def local_search(item: Item, api_key: str=Header(...)):
     try:
-        if config.api_key != api_key:
-            raise Exception("Invalid api-key")
-        
-        cached_result = get_local_search_cache(item)
+        check_api_key(api_key)
+
+        cache_key, index_version, cached_result = await get_search_cache(item, LOCAL_SEARCH, response_type="Multiple Paragraphs")
         if cached_result:
-            return cached_result
-        
-        (response, context_data) = run_local_search(
-                    root_dir=project_path(item.project_name),
-                    query=item.query,
-                    community_level=int(item.community_level),
-                    response_type="Multiple Paragraphs",
-                    streaming=False,
-                    config_filepath=None,
-                    data_dir=None,
-                )
-
-        result = {
-                "message": "ok",
-                "response": response,
-                "query": item.query,
-            }
-        
-        if item.query_source:
-            result['sources'] = get_query_sources(item.project_name, context_data)
-        
-        if item.context_data:
-            result['context_data'] = context_data
-        
-        set_local_search_cache(item, result)
-        
-        return result
+            return await render_result(item, cached_result['response'], cached_result['context_data'], query_source=item.query_source)
+
+        async with search_limiter.limit(item.project_name):
+            engine = await aget_project_engine(item.project_name)
+            (response, context_data) = await engine.local_search(
+                        query=item.query,
+                        community_level=int(item.community_level),
+                        response_type="Multiple Paragraphs",
+                    )
+
+        await set_search_cache(item, cache_key, index_version, response, context_data)
+
+        return await render_result(item, response, context_data, query_source=item.query_source)
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
     except Exception as e:
         return {
                 "error": str(e),
@@ -105,32 +219,33 @@ def local_search(item: Item, api_key: str=Header(...)):
 
 # -----------------------------------------------------------------
 @app.post("/api/global_search")
-def global_search(item: Item, api_key: str=Header(...)):
+async def global_search(item: Item, api_key: str=Header(...)):
     try:
-        if config.api_key != api_key:
-            raise Exception("Invalid api-key")
-
-        (response, context_data) = run_global_search(
-                    root_dir=project_path(item.project_name),
-                    query=item.query,
-                    community_level=int(item.community_level),
-                    response_type="Multiple Paragraphs",
-                    dynamic_community_selection=bool(item.dynamic_community_selection),
-                    streaming=False,
-                    config_filepath=None,
-                    data_dir=None,
-                )
-
-        result = {
-                "message": "ok",
-                "response": response,
-                "query": item.query,
-            }
-        
-        if item.context_data:
-            result['context_data'] = context_data
-        
-        return result
+        check_api_key(api_key)
+
+        cache_key, index_version, cached_result = await get_search_cache(
+            item,
+            GLOBAL_SEARCH,
+            response_type="Multiple Paragraphs",
+            dynamic_community_selection=bool(item.dynamic_community_selection),
+        )
+        if cached_result:
+            return await render_result(item, cached_result['response'], cached_result['context_data'])
+
+        async with search_limiter.limit(item.project_name):
+            engine = await aget_project_engine(item.project_name)
+            (response, context_data) = await engine.global_search(
+                        query=item.query,
+                        community_level=int(item.community_level),
+                        response_type="Multiple Paragraphs",
+                        dynamic_community_selection=bool(item.dynamic_community_selection),
+                    )
+
+        await set_search_cache(item, cache_key, index_version, response, context_data)
+
+        return await render_result(item, response, context_data)
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
     except Exception as e:
         return {
                 "error": str(e),
@@ -138,30 +253,222 @@ def global_search(item: Item, api_key: str=Header(...)):
 
 
 @app.post("/api/drift_search")
-def global_search(item: Item, api_key: str=Header(...)):
+async def drift_search(item: Item, api_key: str=Header(...)):
     try:
-        if config.api_key != api_key:
-            raise Exception("Invalid api-key")
-
-        (response, context_data) = run_drift_search(
-                    root_dir=project_path(item.project_name),
-                    query=item.query,
-                    community_level=int(item.community_level),
-                    streaming=False,
-                    config_filepath=None,
-                    data_dir=None,
-                )
-
-        result = {
+        check_api_key(api_key)
+
+        cache_key, index_version, cached_result = await get_search_cache(item, DRIFT_SEARCH)
+        if cached_result:
+            return await render_result(item, cached_result['response'], cached_result['context_data'])
+
+        async with search_limiter.limit(item.project_name):
+            engine = await aget_project_engine(item.project_name)
+            (response, context_data) = await engine.drift_search(
+                        query=item.query,
+                        community_level=int(item.community_level),
+                    )
+
+        await set_search_cache(item, cache_key, index_version, response, context_data)
+
+        return await render_result(item, response, context_data)
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+@app.post("/api/local_search/stream")
+async def local_search_stream(item: Item, api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        return await stream_search(
+            item,
+            LOCAL_SEARCH,
+            lambda engine: engine.local_search_streaming(
+                query=item.query,
+                community_level=int(item.community_level),
+                response_type="Multiple Paragraphs",
+            ),
+            query_source=item.query_source,
+            response_type="Multiple Paragraphs",
+        )
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+@app.post("/api/global_search/stream")
+async def global_search_stream(item: Item, api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        return await stream_search(
+            item,
+            GLOBAL_SEARCH,
+            lambda engine: engine.global_search_streaming(
+                query=item.query,
+                community_level=int(item.community_level),
+                response_type="Multiple Paragraphs",
+                dynamic_community_selection=bool(item.dynamic_community_selection),
+            ),
+            response_type="Multiple Paragraphs",
+            dynamic_community_selection=bool(item.dynamic_community_selection),
+        )
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+@app.post("/api/drift_search/stream")
+async def drift_search_stream(item: Item, api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        return await stream_search(
+            item,
+            DRIFT_SEARCH,
+            lambda engine: engine.drift_search_streaming(
+                query=item.query,
+                community_level=int(item.community_level),
+            ),
+        )
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+async def batch_search_response(batch: BatchItem):
+    if batch.search_type not in [LOCAL_SEARCH, GLOBAL_SEARCH, DRIFT_SEARCH]:
+        raise Exception(f"Unknown search type {batch.search_type}")
+
+    if len(batch.queries) == 0:
+        raise Exception("queries can not be empty")
+
+    job_id = batch.job_id or make_batch_job_id(
+        batch.project_name,
+        batch.search_type,
+        batch.community_level,
+        batch.dynamic_community_selection,
+        await asyncio.to_thread(get_index_generation, batch.project_name),
+        batch.queries,
+    )
+    if not job_id.isalnum():
+        raise Exception("Invalid job id")
+    parallelism = min(max(1, batch.parallelism), config.api_batch_max_parallelism)
+
+    # a full project is still a plain 429/503, each query then takes its own slot
+    search_limiter.check(batch.project_name)
+
+    async def lines():
+        try:
+            engine = await aget_project_engine(batch.project_name)
+            async for line in run_batch_search(
+                engine,
+                project_name=batch.project_name,
+                job_id=job_id,
+                queries=batch.queries,
+                search_type=batch.search_type,
+                community_level=int(batch.community_level),
+                response_type="Multiple Paragraphs",
+                dynamic_community_selection=bool(batch.dynamic_community_selection),
+                parallelism=parallelism,
+                context_data=batch.context_data,
+            ):
+                yield line
+        except Exception as e:
+            yield json.dumps({"job_id": job_id, "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Job-Id": job_id})
+
+
+@app.post("/api/batch_search")
+async def batch_search(batch: BatchItem, api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        return await batch_search_response(batch)
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+@app.post("/api/batch_search/upload")
+async def batch_search_upload(file: UploadFile=File(...),
+                              project_name: str=Form(...),
+                              search_type: str=Form(LOCAL_SEARCH),
+                              community_level: int=Form(2),
+                              dynamic_community_selection: bool=Form(False),
+                              context_data: bool=Form(False),
+                              parallelism: int=Form(config.api_batch_parallelism),
+                              job_id: str=Form(""),
+                              api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        content = await file.read()
+        batch = BatchItem(
+            queries=parse_batch_queries(content.decode("utf-8").splitlines()),
+            project_name=project_name,
+            search_type=search_type,
+            community_level=community_level,
+            dynamic_community_selection=dynamic_community_selection,
+            context_data=context_data,
+            parallelism=parallelism,
+            job_id=job_id,
+        )
+        return await batch_search_response(batch)
+    except LimitExceeded as e:
+        return limit_exceeded_response(e)
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+@app.get("/api/batch_search/{job_id}")
+async def batch_search_results(job_id: str, api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        if not job_id.isalnum():
+            raise Exception("Invalid job id")
+
+        job_file = get_batch_job_file(job_id)
+        if not os.path.exists(job_file):
+            raise Exception(f"Job {job_id} not found")
+
+        return FileResponse(job_file, media_type="application/x-ndjson")
+    except Exception as e:
+        return {
+                "error": str(e),
+               }
+
+
+@app.get("/api/cache_stats")
+async def cache_stats(api_key: str=Header(...)):
+    try:
+        check_api_key(api_key)
+
+        return {
                 "message": "ok",
-                "response": response,
-                "query": item.query,
+                "result_cache": await asyncio.to_thread(result_cache.stats),
+                "limiter": search_limiter.stats(),
             }
-
-        if item.context_data:
-            result['context_data'] = context_data
-        
-        return result
     except Exception as e:
         return {
                 "error": str(e),
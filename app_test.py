@@ -1,4 +1,6 @@
 
+import asyncio
+import concurrent.futures
 import json
 import os
 import streamlit as st
@@ -9,42 +11,18 @@ from libs.render_context import get_real_response, render_context_data_drift, re
 from libs.save_settings import set_settings
 from libs.common import get_project_names, project_path, restart_component
 import pandas as pd
-import libs.config as config
 from graphrag.cli.query import run_local_search, run_global_search, run_drift_search
-from openai import AzureOpenAI
 import yaml
 from yaml.loader import SafeLoader
 import streamlit_authenticator as stauth
 from libs.render_excel import render_excel_file
+from libs.answer_score import response_score, score_answers, score_stats
+from libs.batch_test import append_checkpoint, get_checkpoint_file, read_checkpoint
+from libs.index_manifest import get_index_generation
+from libs.query_engine import DRIFT_SEARCH, GLOBAL_SEARCH, LOCAL_SEARCH, get_project_engine
 
 load_dotenv()
 
-client = AzureOpenAI(
-    api_version=config.search_azure_api_version,
-    azure_endpoint=config.search_azure_api_base,
-    azure_deployment=config.search_azure_chat_deployment_name,
-    api_key=config.search_azure_api_key,
-)
-
-
-def response_score(query:str, standard_answer:str, generated_answer:str):
-    completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "你是一个答案评分助手，我给你问题、标准答案和AI生成的答案，请给你AI生成的答案评分，满分 100 分，最小分0分，分数需要是整数，你只需要给出分数即可。如果AI生成的答案与标准答案含义相同或者能包含标准答案的含义，则满分，否则分数递减。",
-            },
-            {
-                "role": "user",
-                "content": f"问题：{query} \n\n标准答案：{standard_answer} \n\nAI生成的答案：{generated_answer} \n\n",
-            }
-        ],
-        model=config.search_azure_chat_model_id,
-    )
-    ai_txt = completion.choices[0].message.content
-    return ai_txt
-
-
 def page():
     restart_component()
 
@@ -157,8 +135,7 @@ def page():
     
     st.markdown("Put the question in a field called `query`, When all queries are executed, you can download the file.")
     st.markdown("If a column named `answer` is used as the standard answer, automated testing calculates answer score.")
-    st.markdown("Currently, only `Local Search` is supported.")
-    st.markdown("Query `cache` enabled, the same query will not be executed multiple times.")
+    st.markdown("Every finished row is saved, resubmitting the same file with the same settings only runs the remaining rows.")
     
     # download test set excel file
     st.markdown("-----------------")
@@ -171,7 +148,13 @@ def page():
     )
     st.markdown("-----------------")
     
-    enable_print_context = st.checkbox("Print every item context", value=False)
+    c1, c2, c3 = st.columns([1, 1, 1])
+    with c1:
+        batch_search_type = st.selectbox("Search Type", [LOCAL_SEARCH, GLOBAL_SEARCH, DRIFT_SEARCH], key="batch_search_type")
+    with c2:
+        batch_workers = st.number_input("Workers", min_value=1, max_value=16, value=4, key="batch_workers")
+    with c3:
+        enable_print_context = st.checkbox("Print every item context", value=False)
     
     uploaded_file = st.file_uploader(
         label="upload",
@@ -182,7 +165,7 @@ def page():
     )
     
     if uploaded_file is not None:
-        output = test_file(uploaded_file, project_name, community_level, response_type, enable_print_context)
+        output = test_file(uploaded_file, project_name, community_level, response_type, enable_print_context, batch_search_type, batch_workers)
         st.markdown("-------------------------------------------")
         st.download_button(
             label="Download Test Results",
@@ -206,61 +189,162 @@ def page():
     #             st.success(result.response)
 
 
+def run_test_row(engine, search_type, query, standard_answer, community_level, response_type):
+    (response, context_data) = asyncio.run(engine.search(
+        search_type=search_type,
+        query=query,
+        community_level=int(community_level),
+        response_type=response_type,
+    ))
+
+    score = None
+    if standard_answer is not None:
+        try:
+            score = response_score(query, standard_answer, response)
+        except Exception:
+            # keep the answer, the row is scored again in the sheet's scoring pass
+            pass
+
+    return response, context_data, score
+
+
+def render_test_row(row, row_count, enable_print_context, search_type):
+    st.markdown(f"## {row['index']+1}/{row_count}")
+    st.info(f"Query: {row['query']}")
+
+    if row['answer'] is not None:
+        st.warning(f"Answer: {row['answer']}")
+
+    if row.get('error'):
+        st.error(f"Error: {row['error']}")
+        return
+
+    result = get_real_response(row['response'])
+    st.success(f"GraphRAG (chars {len(result)}): {row['response']}")
+
+    if row['score'] is not None:
+        st.write(f"Score: `{row['score']}`")
+
+    if enable_print_context:
+        if search_type == LOCAL_SEARCH:
+            render_context_data_local(row['context_data'])
+        elif search_type == GLOBAL_SEARCH:
+            render_context_data_global(row['context_data'])
+        else:
+            render_context_data_drift(row['context_data'])
+
+
 @st.cache_data
-def test_file(uploaded_file, project_name, community_level, response_type, enable_print_context):
-    excel_data = pd.ExcelFile(uploaded_file)
+def test_file(uploaded_file, project_name, community_level, response_type, enable_print_context, search_type=LOCAL_SEARCH, workers=4):
+    file_bytes = uploaded_file.getvalue()
+    excel_data = pd.ExcelFile(io.BytesIO(file_bytes))
     modified_sheets = {}
+    score_summary = {}
+    all_scores = []
+
+    checkpoint_file = get_checkpoint_file(file_bytes, project_name, get_index_generation(project_name), search_type, community_level, response_type)
+    finished_rows = read_checkpoint(checkpoint_file)
+    if len(finished_rows) > 0:
+        st.info(f"Resuming: `{len(finished_rows)}` rows already finished.")
+
+    engine = get_project_engine(project_name)
 
     for sheet_name in excel_data.sheet_names:
         st.write(f"### Sheet: {sheet_name}")
         
         sheet_df = excel_data.parse(sheet_name)
         row_count = len(sheet_df)
+
+        if 'query' not in sheet_df.columns:
+            raise Exception("query must be in every row")
         
         modified_df = sheet_df.copy()
-        
-        for index, row in sheet_df.iterrows():
-            if 'query' not in row:
-                raise Exception("query must be in every row")
-
-            index_name = f"{index+1}/{row_count}"
-            st.markdown(f"## {index_name}")
-            with st.spinner(f'Generating ...'):
-                
-                query = row['query']
-
-                (response, context_data) = run_local_search(
-                    root_dir=project_path(project_name),
-                    query=query,
-                    community_level=int(community_level),
-                    response_type=response_type,
-                    streaming=False,
-                    config_filepath=None,
-                    data_dir=None,
-                )
-                
-                st.info(f"Query: {row['query']}")
-                
-                if 'answer' in row:
-                    st.warning(f"Answer: {row['answer']}")
-
-                modified_df.at[index, "GraphRAG"] = response
-                result = get_real_response(response)
-                st.success(f"GraphRAG (chars {len(result)}): {response}")
-                # modified_df.at[index, f"{project_name}_response_count"] = len(result)
-                # modified_df.at[index, f"{project_name}_context_data"] = json.dumps(context_data, ensure_ascii=False, indent=4)
-                # modified_df.at[index, f"{project_name}_response_type"] = response_type
-                if enable_print_context:
-                    render_context_data_local(context_data)
+        has_answer = 'answer' in sheet_df.columns
+
+        rows = {}
+        pending = []
+        for index in sheet_df.index:
+            if (sheet_name, index) in finished_rows:
+                rows[index] = finished_rows[(sheet_name, index)]
+            else:
+                pending.append(index)
+
+        # before any row starts, so the rows find their queries embedded and searched in one batch
+        try:
+            engine.prefetch_query_embeddings(search_type, [sheet_df.loc[index]['query'] for index in pending], int(community_level))
+        except Exception:
+            # every row still embeds its query on the way
+            pass
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=int(workers)) as executor:
+            future_to_index = {}
+            for index in pending:
+                row = sheet_df.loc[index]
+                standard_answer = row['answer'] if has_answer else None
+                future = executor.submit(run_test_row, engine, search_type, row['query'], standard_answer, community_level, response_type)
+                future_to_index[future] = index
+
+            with st.spinner(f'Generating {len(future_to_index)} rows ...'):
+                for future in concurrent.futures.as_completed(future_to_index):
+                    index = future_to_index[future]
+                    row = sheet_df.loc[index]
+                    result = {
+                        "sheet": sheet_name,
+                        "index": index,
+                        "query": row['query'],
+                        "answer": row['answer'] if has_answer else None,
+                    }
+                    try:
+                        response, context_data, score = future.result()
+                        result.update({"response": response, "context_data": context_data, "score": score})
+                        # persist as soon as the row is done, a crash only loses rows in flight
+                        append_checkpoint(checkpoint_file, result)
+                    except Exception as e:
+                        result.update({"error": str(e), "response": "", "context_data": None, "score": None})
+
+                    rows[index] = result
+                    render_test_row(result, row_count, enable_print_context, search_type)
+
+        # rows of the sheet that failed before their search leave prefetched results behind
+        engine.clear_prefetched()
+
+        if has_answer:
+            unscored = [index for index in sheet_df.index if not rows[index].get('error') and rows[index]['score'] is None]
+            if len(unscored) > 0:
+                with st.spinner(f'Scoring {len(unscored)} rows ...'):
+                    scores = score_answers(
+                        [(rows[index]['query'], rows[index]['answer'], rows[index]['response']) for index in unscored],
+                        workers=int(workers),
+                    )
+                for index, (score, error) in zip(unscored, scores):
+                    if error is not None:
+                        st.error(f"Scoring row {index + 1} failed: {error}")
+                    if score is not None:
+                        rows[index]['score'] = score
+                        append_checkpoint(checkpoint_file, rows[index])
+
+            sheet_scores = [rows[index]['score'] for index in sheet_df.index]
+            all_scores.extend(sheet_scores)
+            score_summary[sheet_name] = score_stats(sheet_scores)
+            st.write(score_summary[sheet_name])
+
+        for index in sheet_df.index:
+            row = rows[index]
+            modified_df.at[index, "GraphRAG"] = row['response']
+            if has_answer:
+                modified_df.at[index, "score"] = row['score']
         
         modified_sheets[sheet_name] = modified_df
     
+    if len(score_summary) > 1:
+        score_summary["All"] = score_stats(all_scores)
+
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         for sheet_name, df in modified_sheets.items():
             df.to_excel(writer, sheet_name=sheet_name, index=False)   
     
-    output = render_excel_file(output)
+    output = render_excel_file(output, score_summary)
     return output
 
 
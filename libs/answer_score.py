@@ -0,0 +1,118 @@
+import concurrent.futures
+import json
+import re
+import time
+
+from openai import AzureOpenAI
+
+import libs.config as config
+from libs.common import generate_text_fingerprint, get_retry_after, retryable_openai_errors
+from libs.result_cache import ResultCache
+
+score_prompt = "你是一个答案评分助手，我给你问题、标准答案和AI生成的答案，请给你AI生成的答案评分，满分 100 分，最小分0分，分数需要是整数，你只需要给出分数即可。如果AI生成的答案与标准答案含义相同或者能包含标准答案的含义，则满分，否则分数递减。"
+
+score_buckets = [(0, 59), (60, 69), (70, 79), (80, 89), (90, 99), (100, 100)]
+
+client = AzureOpenAI(
+    api_version=config.search_azure_api_version,
+    azure_endpoint=config.search_azure_api_base,
+    azure_deployment=config.search_azure_chat_deployment_name,
+    api_key=config.search_azure_api_key,
+    # retries are ours, so backoff can follow Retry-After across the whole pool
+    max_retries=0,
+)
+
+# scores never go stale on their own, the key already covers every input
+score_cache = ResultCache(
+    ttl=config.score_cache_ttl,
+    max_bytes=config.score_cache_max_bytes,
+    db_path=config.score_cache_db,
+)
+
+
+def make_score_key(query: str, standard_answer: str, generated_answer: str):
+    return generate_text_fingerprint(json.dumps({
+        "query": str(query),
+        "standard_answer": str(standard_answer),
+        "generated_answer": str(generated_answer),
+        "prompt": score_prompt,
+        "model": config.search_azure_chat_model_id,
+    }, sort_keys=True, ensure_ascii=False))
+
+
+def parse_score(text: str):
+    """First integer in the reply clamped to 0-100, e.g. `评分：85分` or `85/100`; None when there is none."""
+    if text is None:
+        return None
+    match = re.search(r"-?\d+(?:\.\d+)?", text)
+    if not match:
+        return None
+    return max(0, min(100, int(round(float(match.group())))))
+
+
+def request_score(query: str, standard_answer: str, generated_answer: str):
+    for attempt in range(config.score_max_retries + 1):
+        try:
+            completion = client.chat.completions.create(
+                messages=[
+                    {
+                        "role": "system",
+                        "content": score_prompt,
+                    },
+                    {
+                        "role": "user",
+                        "content": f"问题：{query} \n\n标准答案：{standard_answer} \n\nAI生成的答案：{generated_answer} \n\n",
+                    }
+                ],
+                model=config.search_azure_chat_model_id,
+            )
+            return completion.choices[0].message.content
+        except retryable_openai_errors as e:
+            if attempt == config.score_max_retries:
+                raise
+            time.sleep(get_retry_after(e, attempt))
+
+
+def response_score(query: str, standard_answer: str, generated_answer: str):
+    """Integer score of the generated answer, or None if the reply had no number in it."""
+    key = make_score_key(query, standard_answer, generated_answer)
+    cached = score_cache.get(key)
+    if cached is not None:
+        return cached['score']
+
+    ai_txt = request_score(query, standard_answer, generated_answer)
+    score = parse_score(ai_txt)
+    # an unparseable reply is not cached, the next run asks again
+    if score is not None:
+        score_cache.set(key, {"score": score, "reply": ai_txt})
+    return score
+
+
+def score_answers(items: list[tuple[str, str, str]], workers: int = 4):
+    """Score (query, standard answer, generated answer) items in parallel, as (score, error) in input order.
+
+    A failed item gets a None score and its error instead of failing the batch.
+    """
+    def score_item(item):
+        try:
+            return response_score(*item), None
+        except Exception as e:
+            return None, str(e)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(score_item, items))
+
+
+def score_stats(scores: list):
+    """Mean and bucketed distribution of the scores, ignoring rows without one."""
+    scored = [score for score in scores if score is not None]
+    stats = {
+        "rows": len(scores),
+        "scored": len(scored),
+        "mean": round(sum(scored) / len(scored), 2) if scored else None,
+        "min": min(scored) if scored else None,
+        "max": max(scored) if scored else None,
+    }
+    for low, high in score_buckets:
+        stats[f"{low}-{high}" if low != high else str(low)] = len([score for score in scored if low <= score <= high])
+    return stats
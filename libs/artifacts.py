@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import libs.config as config
+from libs.index_manifest import get_index_generation, get_output_dir
+
+# (project, generation, table, columns) -> pyarrow.Table, older generations age out of the lru
+artifact_tables = OrderedDict()
+artifact_tables_lock = threading.Lock()
+
+
+def get_artifact_file(project_name: str, table_name: str):
+    return get_output_dir(project_name) / f"{table_name}.parquet"
+
+
+def artifact_exists(project_name: str, table_name: str):
+    return get_artifact_file(project_name, table_name).exists()
+
+
+def read_artifact_table(project_name: str, table_name: str, columns: list[str] = None) -> pa.Table:
+    """An index artifact as a memory-mapped Arrow table with only the requested columns.
+
+    Requested columns the file does not have are skipped, so callers can ask for columns of
+    several graphrag versions at once. Tables are cached per project and index generation.
+    """
+    generation = get_index_generation(project_name)
+    key = (project_name, generation, table_name, tuple(columns) if columns is not None else None)
+
+    with artifact_tables_lock:
+        table = artifact_tables.get(key)
+        if table is not None:
+            artifact_tables.move_to_end(key)
+            return table
+
+    artifact_file = get_artifact_file(project_name, table_name)
+    if columns is not None:
+        schema_names = pq.read_schema(artifact_file).names
+        columns = [column for column in columns if column in schema_names]
+    table = pq.read_table(artifact_file, columns=columns, memory_map=True)
+
+    with artifact_tables_lock:
+        artifact_tables[key] = table
+        while len(artifact_tables) > config.artifact_cache_entries:
+            artifact_tables.popitem(last=False)
+    return table
+
+
+def read_artifact(project_name: str, table_name: str, columns: list[str] = None):
+    """Like `read_artifact_table`, as a pandas DataFrame."""
+    return read_artifact_table(project_name, table_name, columns).to_pandas()
+
+
+def read_artifact_head(project_name: str, table_name: str, rows: int):
+    """Row count and the first `rows` rows, without reading the rest of the file."""
+    parquet_file = pq.ParquetFile(get_artifact_file(project_name, table_name), memory_map=True)
+    batches = parquet_file.iter_batches(batch_size=rows)
+    head = next(batches, None)
+    head_df = head.to_pandas() if head is not None else parquet_file.schema_arrow.empty_table().to_pandas()
+    return parquet_file.metadata.num_rows, head_df
+
+
+def read_embeddings(project_name: str, table_name: str, column: str, id_column: str = "id"):
+    """Ids and a contiguous (rows, dimension) float32 matrix of an embedding column.
+
+    Rows without an embedding are left out.
+    """
+    table = read_artifact_table(project_name, table_name, [id_column, column])
+    if column not in table.column_names:
+        return [], np.zeros((0, 0), dtype=np.float32)
+
+    table = table.filter(pc.is_valid(table.column(column)))
+    embeddings = table.column(column).combine_chunks()
+    if len(embeddings) == 0:
+        return [], np.zeros((0, 0), dtype=np.float32)
+
+    # list<float> keeps all values in one child buffer, reshape it instead of building row lists
+    values = embeddings.flatten().to_numpy(zero_copy_only=False)
+    matrix = np.ascontiguousarray(values.reshape(len(embeddings), -1), dtype=np.float32)
+    return table.column(id_column).to_pylist(), matrix
+
+
+def clear_artifacts(project_name: str = None):
+    """Drop cached tables, their memory maps would keep deleted or replaced parquet files on disk."""
+    with artifact_tables_lock:
+        for key in [key for key in artifact_tables if project_name is None or key[0] == project_name]:
+            del artifact_tables[key]
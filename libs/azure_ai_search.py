@@ -2,7 +2,11 @@
 # Licensed under the MIT License
 
 """A package containing the Azure AI Search  vector store implementation."""
+import concurrent.futures
 import json
+import time
+import streamlit as st
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from graphrag.vector_stores.azure_ai_search import AzureAISearch
 from graphrag.vector_stores.base import (
     VectorStoreDocument,
@@ -19,7 +23,11 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmMetric,
     VectorSearchProfile,
 )
-from libs.common import debug
+from libs.common import debug, get_retry_after
+import libs.config as config
+
+# throttled or briefly unavailable, worth sending again
+retryable_status_codes = (429, 503)
 
 class AzureAISearch(AzureAISearch):
     """The Azure AI Search vector storage implementation."""
@@ -77,28 +85,94 @@ class AzureAISearch(AzureAISearch):
                 index,
             )
 
-        batch = [
+        documents = [
             {
                 "id": doc.id,
-                "vector": doc.vector,
+                "vector": [float(value) for value in doc.vector],
                 "text": doc.text,
                 "attributes": json.dumps(doc.attributes),
             }
             for doc in documents
             if doc.vector is not None
         ]
+        self.upload_documents(documents)
+
+    def upload_documents(self, documents: list[dict]) -> int:
+        """Upload in batches bounded by count and payload size, several batches at a time."""
+        batches = make_batches(documents, config.ai_search_batch_max_docs, config.ai_search_batch_max_bytes)
+        if len(batches) == 0:
+            return 0
+
+        started_at = time.time()
+        uploaded = 0
+        progress = st.progress(0.0, text=f"Uploading {len(documents)} documents to {self.collection_name} ...")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=config.ai_search_upload_concurrency) as executor:
+            futures = [executor.submit(self.upload_batch, batch) for batch in batches]
+            for future in concurrent.futures.as_completed(futures):
+                uploaded += future.result()
+                elapsed = time.time() - started_at
+                progress.progress(
+                    uploaded / len(documents),
+                    text=f"Uploaded {uploaded}/{len(documents)} documents ({uploaded / elapsed if elapsed > 0 else 0:.0f} docs/s)",
+                )
+                debug(f"Uploaded {uploaded}/{len(documents)} items")
+
+        return uploaded
+
+    def upload_batch(self, batch: list[dict]) -> int:
+        """Upload one batch, retrying throttled requests and throttled documents with backoff."""
+        pending = batch
+        for attempt in range(config.ai_search_max_retries + 1):
+            try:
+                results = self.db_connection.upload_documents(pending)
+            except HttpResponseError as e:
+                if e.status_code not in retryable_status_codes or attempt == config.ai_search_max_retries:
+                    raise
+                time.sleep(get_retry_after(e, attempt))
+                continue
+
+            failed_ids = {result.key for result in results if not result.succeeded and result.status_code in retryable_status_codes}
+            errors = [result for result in results if not result.succeeded and result.status_code not in retryable_status_codes]
+            if errors:
+                raise Exception(f"Failed to upload {len(errors)} documents: {errors[0].key} {errors[0].error_message}")
+            if not failed_ids:
+                return len(batch)
+            if attempt == config.ai_search_max_retries:
+                raise Exception(f"Failed to upload {len(failed_ids)} throttled documents after {attempt + 1} attempts")
+
+            pending = [document for document in pending if document["id"] in failed_ids]
+            time.sleep(get_retry_after(None, attempt))
+
+        return len(batch)
+
+    def count_documents(self) -> int:
+        try:
+            return self.db_connection.get_document_count()
+        except ResourceNotFoundError:
+            return 0
+
+    def delete_documents(self, ids: list[str]) -> None:
+        for start in range(0, len(ids), config.ai_search_batch_max_docs):
+            batch = [{"id": str(id)} for id in ids[start:start + config.ai_search_batch_max_docs]]
+            self.db_connection.delete_documents(documents=batch)
+            debug(f"Deleted {len(batch)} items")
 
 
-        # save the batch by self.db_connection.upload_documents(batch) each 100 items
-        batch_size = 200
-        num_batches = len(batch) // batch_size + (1 if len(batch) % batch_size!= 0 else 0)
+def make_batches(documents: list[dict], max_docs: int, max_bytes: int) -> list[list[dict]]:
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for document in documents:
+        size = len(json.dumps(document))
+        if batch and (len(batch) >= max_docs or batch_bytes + size > max_bytes):
+            batches.append(batch)
+            batch = []
+            batch_bytes = 0
+        batch.append(document)
+        batch_bytes += size
 
-        for i in range(num_batches):
-            start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(batch))
-            current_batch = batch[start_index:end_index]
-            self.db_connection.upload_documents(current_batch)
-            debug(f"Uploaded {len(current_batch)} items")
+    if batch:
+        batches.append(batch)
+    return batches
 
-        if len(batch) > 0:
-            self.db_connection.upload_documents(batch)
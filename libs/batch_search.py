@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import time
+
+import libs.config as config
+from libs.common import generate_text_fingerprint
+from libs.limiter import LimitExceeded, search_limiter
+from libs.result_cache import normalize_query
+
+
+def get_batch_job_file(job_id: str):
+    return os.path.join(config.batch_jobs_dir, f"{job_id}.jsonl")
+
+
+def make_batch_job_id(project_name: str,
+                      search_type: str,
+                      community_level: int,
+                      dynamic_community_selection: bool,
+                      generation: str,
+                      queries: list[str]):
+    # the same batch submitted twice against the same index gets the same id, so it resumes by default
+    payload = json.dumps({
+        "project_name": project_name,
+        "search_type": search_type,
+        "community_level": int(community_level),
+        "dynamic_community_selection": bool(dynamic_community_selection),
+        "generation": generation,
+        "queries": sorted(set(normalize_query(query) for query in queries)),
+    }, ensure_ascii=False)
+    return generate_text_fingerprint(payload)[:16]
+
+
+def parse_batch_queries(lines: list[str]):
+    """Queries from JSONL lines, each line either a JSON string or an object with a `query` field."""
+    queries = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        row = json.loads(line)
+        if isinstance(row, dict):
+            row = row['query']
+        queries.append(str(row))
+    return queries
+
+
+def read_batch_job(job_id: str, generation: str):
+    """Completed results of a job against index `generation`, keyed by normalized query.
+
+    A job id given by the client outlives index rebuilds, answers of another generation are
+    not replayed.
+    """
+    results = {}
+    job_file = get_batch_job_file(job_id)
+    if not os.path.exists(job_file):
+        return results
+
+    with open(job_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # a line cut short by a crash, the query will simply run again
+                continue
+            if not result.get('error') and result.get('generation') == generation:
+                results[normalize_query(result['query'])] = result
+    return results
+
+
+def group_batch_queries(queries: list[str]):
+    """Unique queries in submission order with the indexes they were submitted at."""
+    groups = {}
+    for index, query in enumerate(queries):
+        key = normalize_query(query)
+        if key not in groups:
+            groups[key] = {"query": query, "indexes": []}
+        groups[key]['indexes'].append(index)
+    return groups
+
+
+async def run_batch_search(engine,
+                           project_name: str,
+                           job_id: str,
+                           queries: list[str],
+                           search_type: str,
+                           community_level: int,
+                           response_type: str,
+                           dynamic_community_selection: bool=False,
+                           parallelism: int=4,
+                           context_data: bool=False):
+    """Run a batch against one engine and yield JSONL lines as queries complete.
+
+    Every query takes its own slot of the project's search limiter, `parallelism` only
+    bounds how many of them the batch has queued at once.
+    """
+    os.makedirs(config.batch_jobs_dir, exist_ok=True)
+    started_at = time.time()
+
+    groups = group_batch_queries(queries)
+    completed = read_batch_job(job_id, engine.generation)
+    pending = [key for key in groups if key not in completed]
+
+    yield json.dumps({
+        "job_id": job_id,
+        "total": len(queries),
+        "unique": len(groups),
+        "completed": len(groups) - len(pending),
+        "pending": len(pending),
+    }, ensure_ascii=False) + "\n"
+
+    for key, group in groups.items():
+        if key in completed:
+            result = {**completed[key], "indexes": group['indexes'], "resumed": True}
+            if not context_data:
+                result.pop('context_data', None)
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+
+    if pending:
+        try:
+            await asyncio.to_thread(engine.prefetch_query_embeddings, search_type, [groups[key]['query'] for key in pending], community_level)
+        except Exception:
+            # every query still embeds itself on the way
+            pass
+
+    semaphore = asyncio.Semaphore(max(1, parallelism))
+
+    async def search(query: str):
+        # a batch is background work, it waits for a free slot instead of failing the query
+        while True:
+            try:
+                async with search_limiter.limit(project_name):
+                    return await engine.search(
+                        search_type=search_type,
+                        query=query,
+                        community_level=community_level,
+                        response_type=response_type,
+                        dynamic_community_selection=dynamic_community_selection,
+                    )
+            except LimitExceeded as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def run_query(key: str):
+        group = groups[key]
+        async with semaphore:
+            query_started_at = time.time()
+            try:
+                response, query_context_data = await search(group['query'])
+                result = {
+                    "query": group['query'],
+                    "indexes": group['indexes'],
+                    "generation": engine.generation,
+                    "response": response,
+                    "context_data": query_context_data,
+                    "elapsed": time.time() - query_started_at,
+                }
+            except Exception as e:
+                result = {
+                    "query": group['query'],
+                    "indexes": group['indexes'],
+                    "error": str(e),
+                }
+        return result
+
+    errors = 0
+    tasks = [asyncio.create_task(run_query(key)) for key in pending]
+    try:
+        with open(get_batch_job_file(job_id), "a", encoding="utf-8") as job_file:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                line = json.dumps(result, ensure_ascii=False, default=str)
+
+                # checkpoint before streaming, so a dropped client can resume
+                job_file.write(line + "\n")
+                job_file.flush()
+
+                if result.get('error'):
+                    errors += 1
+                if not context_data:
+                    result.pop('context_data', None)
+                    line = json.dumps(result, ensure_ascii=False, default=str)
+                yield line + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+        engine.clear_prefetched()
+
+    yield json.dumps({
+        "job_id": job_id,
+        "done": True,
+        "errors": errors,
+        "elapsed": time.time() - started_at,
+    }, ensure_ascii=False) + "\n"
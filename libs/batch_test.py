@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import threading
+
+import libs.config as config
+from libs.common import generate_text_fingerprint
+
+checkpoint_lock = threading.Lock()
+
+
+def get_checkpoint_file(file_bytes: bytes,
+                        project_name: str,
+                        generation: str,
+                        search_type: str,
+                        community_level: int,
+                        response_type: str):
+    """One checkpoint file per (workbook content, project, index generation, search settings), so resubmits resume.
+
+    A rebuilt index starts a new checkpoint, answers of the old one are not replayed.
+    """
+    run_key = json.dumps({
+        "file": hashlib.sha256(file_bytes).hexdigest(),
+        "project_name": project_name,
+        "generation": generation,
+        "search_type": search_type,
+        "community_level": int(community_level),
+        "response_type": response_type,
+    }, sort_keys=True)
+    return os.path.join(config.batch_test_dir, f"{project_name}_{generate_text_fingerprint(run_key)[:16]}.jsonl")
+
+
+def read_checkpoint(checkpoint_file: str):
+    """Finished rows keyed by (sheet name, row index)."""
+    rows = {}
+    if not os.path.exists(checkpoint_file):
+        return rows
+
+    with open(checkpoint_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # a row cut short by a crash, it will run again
+                continue
+            rows[(row['sheet'], row['index'])] = row
+    return rows
+
+
+def append_checkpoint(checkpoint_file: str, row: dict):
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    line = json.dumps(row, ensure_ascii=False, default=str)
+    with checkpoint_lock:
+        with open(checkpoint_file, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
@@ -1,4 +1,5 @@
 import os
+import threading
 from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions, ContentSettings
 from datetime import datetime, timedelta, timezone
 import streamlit as st
@@ -8,6 +9,15 @@ load_dotenv()
 
 connection_string = os.getenv("DATA_AZURE_CONNECTION_STRING", "")
 
+sas_url_ttl = timedelta(hours=1)
+# a cached url is handed out only while it stays valid for at least this long
+sas_url_min_remaining = timedelta(minutes=10)
+
+blob_lock = threading.Lock()
+blob_service_client = None
+ready_containers = set()
+sas_url_cache = {}
+
 
 def get_container_name(project_name):
     container_name = "graphrag" + project_name + "cache"
@@ -16,6 +26,31 @@ def get_container_name(project_name):
     return container_name
 
 
+def get_blob_service_client():
+    """One client per process, its http pipeline keeps connections alive between calls."""
+    global blob_service_client
+    with blob_lock:
+        if blob_service_client is None:
+            blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        return blob_service_client
+
+
+def get_ready_container_client(container_name):
+    container_client = get_blob_service_client().get_container_client(container_name)
+
+    with blob_lock:
+        if container_name in ready_containers:
+            return container_client
+
+    if not container_client.exists():
+        container_client.create_container()
+    container_client.set_container_access_policy(signed_identifiers=None, public_access="container")
+
+    with blob_lock:
+        ready_containers.add(container_name)
+    return container_client
+
+
 def upload_file(project_name, file_path):
     
     if not connection_string:
@@ -26,12 +61,7 @@ def upload_file(project_name, file_path):
 
         file_name = os.path.basename(file_path)
 
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-
-        container_client = blob_service_client.get_container_client(container_name)
-
-        if not container_client.exists():
-            container_client.create_container()
+        container_client = get_ready_container_client(container_name)
 
         blob_client = container_client.get_blob_client(file_name)
         
@@ -44,32 +74,51 @@ def upload_file(project_name, file_path):
         
         with open(file_path, "rb") as data:
             blob_client.upload_blob(data, overwrite=True, content_settings=content_settings)
-            container_client.set_container_access_policy(signed_identifiers=None, public_access="container")
     except Exception as e:
+        # the container may have been deleted behind our back, check it again next time
+        with blob_lock:
+            ready_containers.discard(get_container_name(project_name))
         st.error(f"Error uploading file {file_name}: {e}")
 
 
 def get_sas_url(project_name, blob_name):
     try:
         container_name = get_container_name(project_name)
+        now = datetime.now(timezone.utc)
+
+        with blob_lock:
+            cached = sas_url_cache.get((container_name, blob_name))
+        if cached and cached[1] - now > sas_url_min_remaining:
+            return cached[0], ""
 
-        expiry_time = datetime.now(timezone.utc) + timedelta(hours=1)
+        expiry_time = now + sas_url_ttl
 
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        client = get_blob_service_client()
 
         sas_token = generate_blob_sas(
-            connection_string=connection_string,
             container_name=container_name,
-            account_name=blob_service_client.account_name,
+            account_name=client.account_name,
             blob_name=blob_name,
             permission=BlobSasPermissions(read=True),
             expiry=expiry_time,
-            account_key=blob_service_client.credential.account_key
+            account_key=client.credential.account_key
         )
         
-        sas_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
+        sas_url = f"https://{client.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
+
+        with blob_lock:
+            sas_url_cache[(container_name, blob_name)] = (sas_url, expiry_time)
+            # drop urls that are no longer worth handing out
+            if len(sas_url_cache) > 10000:
+                for key in [key for key, value in sas_url_cache.items() if value[1] - now <= sas_url_min_remaining]:
+                    del sas_url_cache[key]
 
         return sas_url, ""
     except Exception as e:
         print(f"Error generating SAS URL for {blob_name}: {e}")
         return "", str(e)
+
+
+def get_sas_urls(project_name, blob_names):
+    """SAS urls of many blobs at once, as {blob_name: (sas_url, error)}."""
+    return {blob_name: get_sas_url(project_name, blob_name) for blob_name in dict.fromkeys(blob_names)}
@@ -5,7 +5,9 @@ from datashaper import WorkflowCallbacks
 import graphrag.api as api
 import streamlit as st
 
-from libs.common import run_command, load_graphrag_config
+from libs.artifacts import clear_artifacts
+from libs.common import purge_cache_json_files, run_command, load_graphrag_config
+from libs.index_manifest import write_index_manifest
 from libs.progress import PrintProgressReporter
 
 
@@ -26,7 +28,7 @@ def build_index(project_name: str):
             #     )
             # ]
             
-            asyncio.run(api.build_index(
+            outputs = asyncio.run(api.build_index(
                     config=config,
                     run_id="",
                     is_resume_run=False,
@@ -35,10 +37,20 @@ def build_index(project_name: str):
                     # callbacks=workflow_callbacks,
                 ))
 
+            if any(output.errors for output in outputs):
+                st.error("Build finished with errors, index generation not updated.")
+            else:
+                manifest = write_index_manifest(project_name)
+                purge_cache_json_files(project_name, keep_generation=manifest['generation'])
+                clear_artifacts(project_name)
+                st.success(f"Index generation: `{manifest['generation']}`")
+
     st.markdown("----------------------------")
     
     if st.button("Clear index files", key="clear_index_" + project_name, icon="🗑️"):
         run_command(f"rm -rf /app/projects/{project_name}/output/*")
+        purge_cache_json_files(project_name)
+        clear_artifacts(project_name)
         st.success("All files deleted.")
         time.sleep(3)
         
@@ -1,5 +1,4 @@
 
-import pandas as pd
 import tiktoken
 
 from graphrag.query.context_builder.entity_extraction import EntityVectorStoreKey
@@ -18,6 +17,7 @@ from graphrag.query.structured_search.local_search.mixed_context import (
 )
 import libs.config as config
 from libs.store_vector import get_embedding_store
+from libs.artifacts import read_artifact
 from graphrag.query.llm.base import BaseLLMCallback
 
 async def run_candidate_questions(
@@ -26,8 +26,6 @@ async def run_candidate_questions(
         question_history: list[str],
         callbacks: list[BaseLLMCallback] | None = None,
         ):
-    input_dir = f"/app/projects/{project_name}/output/artifacts"
-
     # Load tables to dataframes
 
     COMMUNITY_REPORT_TABLE = "create_final_community_reports"
@@ -41,8 +39,9 @@ async def run_candidate_questions(
     # Read entities
 
     # read nodes table to get community and degree data
-    entity_df = pd.read_parquet(f"{input_dir}/{ENTITY_TABLE}.parquet")
-    entity_embedding_df = pd.read_parquet(f"{input_dir}/{ENTITY_EMBEDDING_TABLE}.parquet")
+    # entity embeddings are searched in the vector store, they are not loaded here
+    entity_df = read_artifact(project_name, ENTITY_TABLE, ["id", "title", "degree", "community", "level"])
+    entity_embedding_df = read_artifact(project_name, ENTITY_EMBEDDING_TABLE, ["id", "title", "name", "type", "human_readable_id", "description", "text_unit_ids"])
 
     entities = read_indexer_entities(entity_df, entity_embedding_df, COMMUNITY_LEVEL)
 
@@ -54,7 +53,7 @@ async def run_candidate_questions(
     entity_df.head()
 
     # Read relationships
-    relationship_df = pd.read_parquet(f"{input_dir}/{RELATIONSHIP_TABLE}.parquet")
+    relationship_df = read_artifact(project_name, RELATIONSHIP_TABLE)
     relationships = read_indexer_relationships(relationship_df)
 
     print(f"Relationship count: {len(relationship_df)}")
@@ -62,7 +61,7 @@ async def run_candidate_questions(
 
     # NOTE: covariates are turned off by default, because they generally need prompt tuning to be valuable
     # Please see the GRAPHRAG_CLAIM_* settings
-    # covariate_df = pd.read_parquet(f"{input_dir}/{COVARIATE_TABLE}.parquet")
+    # covariate_df = read_artifact(project_name, COVARIATE_TABLE)
 
     # claims = read_indexer_covariates(covariate_df)
 
@@ -71,7 +70,7 @@ async def run_candidate_questions(
 
     # Read community reports
 
-    report_df = pd.read_parquet(f"{input_dir}/{COMMUNITY_REPORT_TABLE}.parquet")
+    report_df = read_artifact(project_name, COMMUNITY_REPORT_TABLE)
     reports = read_indexer_reports(report_df, entity_df, COMMUNITY_LEVEL)
 
     print(f"Report records: {len(report_df)}")
@@ -79,7 +78,7 @@ async def run_candidate_questions(
 
     # Read text units
 
-    text_unit_df = pd.read_parquet(f"{input_dir}/{TEXT_UNIT_TABLE}.parquet")
+    text_unit_df = read_artifact(project_name, TEXT_UNIT_TABLE)
     text_units = read_indexer_text_units(text_unit_df)
 
     print(f"Text unit records: {len(text_unit_df)}")
@@ -9,8 +9,11 @@ from graphrag.config.load_config import load_config
 from pathlib import Path
 import sys
 import signal
+import shutil
+import random
 
 import hashlib
+import openai
 
 
 def project_path(project_name: str):
@@ -168,19 +171,63 @@ def generate_text_fingerprint(text, algorithm="sha256"):
     return hash_object.hexdigest()
 
 
-def get_cache_json_from_file(cache_key: str):
-    cache_file = f"/app/cache/query_cache/{cache_key}.json"
+# failures of an OpenAI request worth sending it again for
+retryable_openai_errors = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def get_retry_after(e: Exception, attempt: int):
+    """Seconds to wait before retry `attempt`, the service's retry-after-ms or Retry-After when it sent one.
+
+    Otherwise an exponential backoff with jitter, capped at a minute.
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) / scale
+            except ValueError:
+                pass
+    return min(2 ** attempt, 60) + random.random()
+
+
+def get_cache_json_file(cache_key: str, project_name: str=None, generation: str=None):
+    if project_name and generation:
+        return f"/app/cache/query_cache/{project_name}/{generation}/{cache_key}.json"
+    return f"/app/cache/query_cache/{cache_key}.json"
+
+
+def get_cache_json_from_file(cache_key: str, project_name: str=None, generation: str=None):
+    cache_file = get_cache_json_file(cache_key, project_name, generation)
     if os.path.exists(cache_file):
         with open(cache_file, "r") as file:
             return json.load(file)
     return None
 
 
-def set_cache_json_to_file(cache_key: str, data: dict):
-    cache_file = f"/app/cache/query_cache/{cache_key}.json"
+def set_cache_json_to_file(cache_key: str, data: dict, project_name: str=None, generation: str=None):
+    cache_file = get_cache_json_file(cache_key, project_name, generation)
     cache_file_dir = os.path.dirname(cache_file)
     if not os.path.exists(cache_file_dir):
         os.makedirs(cache_file_dir, exist_ok=True)
+        # first write of a new index generation, drop the files of older ones
+        if project_name and generation:
+            purge_cache_json_files(project_name, keep_generation=generation)
         
     with open(cache_file, "w") as file:
         json.dump(data, file, ensure_ascii=False, indent=4)
+
+
+def purge_cache_json_files(project_name: str, keep_generation: str=None):
+    project_cache_dir = f"/app/cache/query_cache/{project_name}"
+    if not os.path.exists(project_cache_dir):
+        return
+    for generation in os.listdir(project_cache_dir):
+        if generation != keep_generation:
+            shutil.rmtree(os.path.join(project_cache_dir, generation), ignore_errors=True)
@@ -13,6 +13,53 @@ app_tip = os.getenv('APP_TIP', '')
 
 is_debug = os.getenv('DEBUG_MODE') == 'true'
 api_key = os.getenv('API_KEY', 'api_key')
+api_max_in_flight = int(os.getenv('API_MAX_IN_FLIGHT', '64'))
+api_project_concurrency = int(os.getenv('API_PROJECT_CONCURRENCY', '8'))
+api_project_queue_size = int(os.getenv('API_PROJECT_QUEUE_SIZE', '32'))
+api_queue_timeout = float(os.getenv('API_QUEUE_TIMEOUT', '30'))
+api_retry_after = int(os.getenv('API_RETRY_AFTER', '5'))
+
+result_cache_ttl = float(os.getenv('RESULT_CACHE_TTL', '86400'))
+result_cache_max_bytes = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+result_cache_db = os.getenv('RESULT_CACHE_DB', '')
+
+batch_jobs_dir = os.getenv('BATCH_JOBS_DIR', '/app/cache/batch_jobs')
+batch_test_dir = os.getenv('BATCH_TEST_DIR', '/app/cache/batch_test')
+api_batch_parallelism = int(os.getenv('API_BATCH_PARALLELISM', '4'))
+api_batch_max_parallelism = int(os.getenv('API_BATCH_MAX_PARALLELISM', '16'))
+
+score_cache_db = os.getenv('SCORE_CACHE_DB', '/app/cache/score_cache.db')
+score_cache_ttl = float(os.getenv('SCORE_CACHE_TTL', str(90 * 86400)))
+score_cache_max_bytes = int(os.getenv('SCORE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+score_max_retries = int(os.getenv('SCORE_MAX_RETRIES', '5'))
+
+page_cache_db = os.getenv('PAGE_CACHE_DB', '/app/cache/page_cache.db')
+page_cache_ttl = float(os.getenv('PAGE_CACHE_TTL', str(365 * 86400)))
+page_cache_max_bytes = int(os.getenv('PAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+pg_pool_min_size = int(os.getenv('PG_POOL_MIN_SIZE', '1'))
+pg_pool_max_size = int(os.getenv('PG_POOL_MAX_SIZE', '16'))
+pg_pool_timeout = float(os.getenv('PG_POOL_TIMEOUT', '30'))
+pg_copy_batch_size = int(os.getenv('PG_COPY_BATCH_SIZE', '5000'))
+pg_vector_type = os.getenv('PG_VECTOR_TYPE', 'vector')
+pg_vector_dimension = int(os.getenv('PG_VECTOR_DIMENSION', '0'))
+pg_index_type = os.getenv('PG_INDEX_TYPE', 'hnsw')
+pg_hnsw_m = int(os.getenv('PG_HNSW_M', '16'))
+pg_hnsw_ef_construction = int(os.getenv('PG_HNSW_EF_CONSTRUCTION', '64'))
+pg_hnsw_ef_search = int(os.getenv('PG_HNSW_EF_SEARCH', '40'))
+pg_ivfflat_lists = int(os.getenv('PG_IVFFLAT_LISTS', '0'))
+pg_ivfflat_probes = int(os.getenv('PG_IVFFLAT_PROBES', '10'))
+
+embedding_batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', '16'))
+vector_search_parallelism = int(os.getenv('VECTOR_SEARCH_PARALLELISM', '8'))
+query_vector_store = os.getenv('QUERY_VECTOR_STORE', 'settings')
+
+artifact_cache_entries = int(os.getenv('ARTIFACT_CACHE_ENTRIES', '32'))
+
+ai_search_batch_max_docs = int(os.getenv('AI_SEARCH_BATCH_MAX_DOCS', '500'))
+ai_search_batch_max_bytes = int(os.getenv('AI_SEARCH_BATCH_MAX_BYTES', str(8 * 1024 * 1024)))
+ai_search_upload_concurrency = int(os.getenv('AI_SEARCH_UPLOAD_CONCURRENCY', '4'))
+ai_search_max_retries = int(os.getenv('AI_SEARCH_MAX_RETRIES', '6'))
 update_time = os.getenv('UPDATE_TIME', time.strftime("%Y-%m-%d %H:%M:%S"))
 
 azure_api_key = os.getenv('AZURE_API_KEY', '')
@@ -32,6 +79,9 @@ data_azure_api_base = os.getenv('DATA_AZURE_API_BASE', '')
 data_azure_api_version = os.getenv('DATA_AZURE_API_VERSION', '')
 data_azure_chat_model_id = os.getenv('DATA_AZURE_CHAT_MODEL_ID', 'gpt-4o-mini')
 data_azure_chat_deployment_name = os.getenv('DATA_AZURE_CHAT_DEPLOYMENT_NAME', 'gpt-4o-mini')
+data_azure_requests_per_minute = int(os.getenv('DATA_AZURE_REQUESTS_PER_MINUTE', '0'))
+data_azure_tokens_per_minute = int(os.getenv('DATA_AZURE_TOKENS_PER_MINUTE', '0'))
+data_azure_concurrency = int(os.getenv('DATA_AZURE_CONCURRENCY', '16'))
 
 search_azure_api_key = os.getenv('SEARCH_AZURE_API_KEY', '')
 search_azure_api_base = os.getenv('SEARCH_AZURE_API_BASE', '')
@@ -41,9 +91,17 @@ search_azure_chat_deployment_name = os.getenv('SEARCH_AZURE_CHAT_DEPLOYMENT_NAME
 
 ai_search_url = os.getenv('AI_SEARCH_URL', '')
 ai_search_key = os.getenv('AI_SEARCH_KEY', '')
+disable_aisearch = os.getenv('DISABLE_AISEARCH') == 'true'
+disable_pgvector = os.getenv('DISABLE_PGVECTOR') == 'true'
 
 di_url = os.getenv('DOCUMENT_INTELLIGENCE_URL', '')
 di_key = os.getenv('DOCUMENT_INTELLIGENCE_KEY', '')
+di_requests_per_minute = int(os.getenv('DOCUMENT_INTELLIGENCE_REQUESTS_PER_MINUTE', '0'))
+di_concurrency = int(os.getenv('DOCUMENT_INTELLIGENCE_CONCURRENCY', '15'))
+
+extract_max_retries = int(os.getenv('EXTRACT_MAX_RETRIES', '6'))
+extract_output_tokens = int(os.getenv('EXTRACT_OUTPUT_TOKENS', '1000'))
+extract_image_tokens = int(os.getenv('EXTRACT_IMAGE_TOKENS', '1105'))
 
 generate_data_vision = 'GPT Vision'
 generate_data_vision_azure = 'Azure Docs'
@@ -51,6 +109,21 @@ generate_data_vision_txt = 'GPT Vision (as text)'
 generate_data_vision_image = 'GPT Vision (as image)'
 generate_data_vision_di = 'Azure AI Document Intelligence (as image)'
 
+pdf_render_workers = int(os.getenv('PDF_RENDER_WORKERS', '0'))
+pdf_render_range_size = int(os.getenv('PDF_RENDER_RANGE_SIZE', '8'))
+pdf_render_dpi = int(os.getenv('PDF_RENDER_DPI', '150'))
+pdf_upload_workers = int(os.getenv('PDF_UPLOAD_WORKERS', '8'))
+pdf_pipeline_queue_size = int(os.getenv('PDF_PIPELINE_QUEUE_SIZE', '16'))
+pdf_page_max_retries = int(os.getenv('PDF_PAGE_MAX_RETRIES', '3'))
+pdf_page_retry_backoff = float(os.getenv('PDF_PAGE_RETRY_BACKOFF', '5'))
+pdf_vision_workers = {
+    generate_data_vision: int(os.getenv('PDF_VISION_WORKERS_GPT', '16')),
+    generate_data_vision_azure: int(os.getenv('PDF_VISION_WORKERS_AZURE_DOCS', '16')),
+    generate_data_vision_txt: int(os.getenv('PDF_VISION_WORKERS_GPT_TEXT', '16')),
+    generate_data_vision_image: int(os.getenv('PDF_VISION_WORKERS_GPT_IMAGE', '16')),
+    generate_data_vision_di: int(os.getenv('PDF_VISION_WORKERS_DI', '16')),
+}
+
 pdf_gpt_vision_prompt = """请处理以下PDF页面的截图与原生提取文本，并按以下要求生成最终的准确文字内容：
 
 1. **文字识别**：对该页截图进行OCR文字识别，将图片中的所有文字内容完整提取出来，包括任何图表中的文字。所有输出内容应基于识别结果，不要生成额外的文字或信息。
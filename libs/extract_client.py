@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import time
+
+import openai
+import tiktoken
+from openai import AsyncAzureOpenAI
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient
+
+import libs.config as config
+from libs.common import get_retry_after, retryable_openai_errors
+
+retryable_status_codes = (408, 429, 500, 502, 503, 504)
+
+DI_DEPLOYMENT = "document-intelligence"
+
+token_encoder = None
+
+
+def get_token_encoder():
+    global token_encoder
+    if token_encoder is None:
+        token_encoder = tiktoken.get_encoding("cl100k_base")
+    return token_encoder
+
+
+def is_retryable(e: Exception):
+    if isinstance(e, retryable_openai_errors):
+        return True
+    if isinstance(e, HttpResponseError):
+        return e.status_code in retryable_status_codes
+    return isinstance(e, (ServiceRequestError, ServiceResponseError))
+
+
+def is_throttled(e: Exception):
+    return isinstance(e, openai.RateLimitError) or getattr(e, "status_code", None) == 429
+
+
+def estimate_chat_tokens(messages: list[dict]):
+    """Tokens a chat request counts against the TPM quota: prompt text, images and the expected reply."""
+    tokens = config.extract_output_tokens
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        for part in content:
+            if part["type"] == "text":
+                tokens += len(get_token_encoder().encode(part["text"]))
+            else:
+                tokens += config.extract_image_tokens
+    return tokens
+
+
+class RateBudget:
+    """Requests and tokens per minute of one deployment, plus its concurrency cap.
+
+    Both budgets refill continuously, a request waits until it fits. A 429 pauses
+    every request of the deployment until Retry-After has passed. Only used from
+    the client's event loop, so no locking.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, concurrency: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.requests = float(requests_per_minute)
+        self.tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        if self.requests_per_minute:
+            self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+
+    async def acquire(self, tokens: int) -> int:
+        """Wait for room for one request of `tokens`, returns the tokens reserved."""
+        if self.tokens_per_minute:
+            # a request larger than the whole budget would never fit
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self.refill()
+            wait = 0.0
+            if self.requests_per_minute and self.requests < 1:
+                wait = max(wait, (1 - self.requests) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and self.tokens < tokens:
+                wait = max(wait, (tokens - self.tokens) * 60 / self.tokens_per_minute)
+            if wait <= 0:
+                if self.requests_per_minute:
+                    self.requests -= 1
+                if self.tokens_per_minute:
+                    self.tokens -= tokens
+                return tokens
+            await asyncio.sleep(wait)
+
+    def settle(self, reserved: int, used: int):
+        """Give back what a request reserved but did not use, or charge what it used beyond that."""
+        if self.tokens_per_minute:
+            self.refill()
+            self.tokens = min(self.tokens_per_minute, self.tokens + reserved - used)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        return {
+            "requests_available": round(self.requests, 1),
+            "tokens_available": round(self.tokens),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 1),
+        }
+
+
+class ExtractClient:
+    """Async Azure OpenAI and Document Intelligence clients for page extraction.
+
+    The clients live on one background event loop, shared by every caller in the
+    process. Worker threads submit requests with the blocking `chat_completion` and
+    `analyze_read`, which queue on the deployment's budget and retry throttled or
+    failed calls after Retry-After.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.openai_client = None
+        self.di_client = None
+        self.budgets = {}
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="extract-client", daemon=True).start()
+                self.loop = loop
+            return self.loop
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop()).result()
+
+    def get_budget(self, deployment: str):
+        # created on the loop, the semaphore belongs to it
+        if deployment not in self.budgets:
+            if deployment == DI_DEPLOYMENT:
+                self.budgets[deployment] = RateBudget(config.di_requests_per_minute, 0, config.di_concurrency)
+            else:
+                self.budgets[deployment] = RateBudget(
+                    config.data_azure_requests_per_minute,
+                    config.data_azure_tokens_per_minute,
+                    config.data_azure_concurrency,
+                )
+        return self.budgets[deployment]
+
+    def get_openai_client(self):
+        if self.openai_client is None:
+            self.openai_client = AsyncAzureOpenAI(
+                api_version=config.data_azure_api_version,
+                azure_endpoint=config.data_azure_api_base,
+                azure_deployment=config.data_azure_chat_deployment_name,
+                api_key=config.data_azure_api_key,
+                # with_budget retries, a 429 then holds back every request of the deployment
+                max_retries=0,
+            )
+        return self.openai_client
+
+    def get_di_client(self):
+        if self.di_client is None:
+            self.di_client = DocumentAnalysisClient(
+                endpoint=config.di_url,
+                credential=AzureKeyCredential(config.di_key),
+            )
+        return self.di_client
+
+    async def with_budget(self, deployment: str, tokens: int, request, get_used_tokens=None):
+        budget = self.get_budget(deployment)
+        for attempt in range(config.extract_max_retries + 1):
+            # the concurrency slot is only held while a request is in flight, not while it
+            # waits for rate budget or through its backoff
+            reserved = await budget.acquire(tokens)
+            async with budget.semaphore:
+                try:
+                    result = await request()
+                except Exception as e:
+                    # a rejected request used no tokens
+                    budget.settle(reserved, 0)
+                    if not is_retryable(e) or attempt == config.extract_max_retries:
+                        raise
+                    delay = get_retry_after(e, attempt)
+                    if is_throttled(e):
+                        budget.pause(delay)
+                else:
+                    budget.settle(reserved, get_used_tokens(result) if get_used_tokens else reserved)
+                    return result
+            await asyncio.sleep(delay)
+
+    async def achat_completion(self, messages: list[dict], model: str, **kwargs):
+        def get_used_tokens(completion):
+            usage = getattr(completion, "usage", None)
+            return usage.total_tokens if usage else estimated
+
+        estimated = estimate_chat_tokens(messages)
+        return await self.with_budget(
+            config.data_azure_chat_deployment_name,
+            estimated,
+            lambda: self.get_openai_client().chat.completions.create(messages=messages, model=model, **kwargs),
+            get_used_tokens,
+        )
+
+    async def aanalyze_read(self, document: bytes):
+        async def request():
+            poller = await self.get_di_client().begin_analyze_document("prebuilt-read", document=document)
+            return await poller.result()
+
+        return await self.with_budget(DI_DEPLOYMENT, 0, request)
+
+    def chat_completion(self, messages: list[dict], model: str, **kwargs):
+        return self.run(self.achat_completion(messages, model, **kwargs))
+
+    def analyze_read(self, document: bytes):
+        return self.run(self.aanalyze_read(document))
+
+    def stats(self):
+        return {deployment: budget.stats() for deployment, budget in list(self.budgets.items())}
+
+
+extract_client = ExtractClient()
@@ -88,6 +88,13 @@ def generate_data(project_name: str):
         time.sleep(3)
         st.success("All files deleted.")
 
+    failed_pages = pdf_txt.list_failed_pages(project_name)
+    if failed_pages and st.button(f"Retry failed PDF pages ({sum(len(pages) for _, _, pages in failed_pages)})", key=f"retry_failed_pages_{project_name}", icon="🔁"):
+        with st.spinner(f"Processing ..."):
+            for pdf_path, pdf_vision_option, pages in failed_pages:
+                st.write(f"retrying {len(pages)} pages of `{os.path.basename(pdf_path)}`")
+                pdf_txt.save_pdf_pages_as_images(pdf_path, project_name, pdf_vision_option)
+
     if st.button("Clear PDF cached files", key=f"delete_all_cached_files_{project_name}", icon="🗑️"):
         run_command(f"rm -rf /app/projects/{project_name}/pdf_cache/*")
         time.sleep(3)
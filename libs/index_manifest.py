@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from libs.common import generate_text_fingerprint, project_path
+
+MANIFEST_FILE = "index_manifest.json"
+
+
+def get_output_dir(project_name: str):
+    return project_path(project_name) / "output"
+
+
+def list_parquet_files(project_name: str):
+    output_dir = get_output_dir(project_name)
+    if not output_dir.exists():
+        return []
+    return sorted(
+        [entry for entry in os.scandir(output_dir) if entry.is_file() and entry.name.endswith(".parquet")],
+        key=lambda e: e.name,
+    )
+
+
+def get_output_signature(project_name: str):
+    """Fingerprint of the project's settings and index output, used to detect rebuilds."""
+    signature = []
+
+    settings_file = project_path(project_name) / "settings.yaml"
+    if settings_file.exists():
+        stat = settings_file.stat()
+        signature.append(("settings.yaml", stat.st_mtime_ns, stat.st_size))
+
+    for entry in list_parquet_files(project_name):
+        stat = entry.stat()
+        signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(signature)
+
+
+def hash_file(file_path: str):
+    hash_object = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def write_index_manifest(project_name: str):
+    """Stamp the current index output with a generation id derived from the parquet contents."""
+    files = {}
+    for entry in list_parquet_files(project_name):
+        stat = entry.stat()
+        files[entry.name] = {
+            "sha256": hash_file(entry.path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    content_hashes = json.dumps({name: file["sha256"] for name, file in files.items()}, sort_keys=True)
+    manifest = {
+        "generation": generate_text_fingerprint(content_hashes)[:16],
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "files": files,
+    }
+
+    manifest_file = get_output_dir(project_name) / MANIFEST_FILE
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_file, manifest_file)
+
+    return manifest
+
+
+def read_index_manifest(project_name: str):
+    manifest_file = get_output_dir(project_name) / MANIFEST_FILE
+    if not manifest_file.exists():
+        return None
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def get_index_generation(project_name: str):
+    """Generation of the index currently on disk.
+
+    The manifest is only trusted while the parquet files still match it. Output
+    written without a manifest (or changed after it) gets a generation from the
+    file signature, so caches never outlive the data they were computed from.
+    """
+    manifest = read_index_manifest(project_name)
+    parquet_files = list_parquet_files(project_name)
+
+    if manifest and len(manifest["files"]) == len(parquet_files):
+        matches = True
+        for entry in parquet_files:
+            file = manifest["files"].get(entry.name)
+            stat = entry.stat()
+            if not file or file["size"] != stat.st_size or file["mtime_ns"] != stat.st_mtime_ns:
+                matches = False
+                break
+        if matches:
+            return manifest["generation"]
+
+    if len(parquet_files) == 0:
+        return "empty"
+
+    return "unstamped-" + generate_text_fingerprint(str(get_output_signature(project_name)))[:16]
@@ -1,7 +1,7 @@
-import os
-import pandas as pd
 import streamlit as st
 
+from libs.artifacts import artifact_exists, read_artifact_head
+
 
 def index_preview(project_name: str):
     if st.button('Preview Index', key=f"index_preview_{project_name}", icon="🔍"):
@@ -35,13 +35,14 @@ def index_preview(project_name: str):
 
 
 def get_parquet_file(project_name:str, artifact_name: str):
-    parquet_path = f"/app/projects/{project_name}/output/{artifact_name}"
-    
-    if not os.path.exists(parquet_path):
+    table_name = artifact_name.removesuffix(".parquet")
+
+    if not artifact_exists(project_name, table_name):
         st.write(f"File not found: `{artifact_name}`")
         return
-    
-    pdc = pd.read_parquet(parquet_path)
-    st.write(f"Items: `{len(pdc)}`")
-    st.write(pdc.head(n=20000))
+
+    # row count comes from the parquet footer, only the previewed rows are decoded
+    items, pdc = read_artifact_head(project_name, table_name, 20000)
+    st.write(f"Items: `{items}`")
+    st.write(pdc)
         
@@ -0,0 +1,89 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import libs.config as config
+
+
+class LimitExceeded(Exception):
+    """Raised when a search can not be admitted, carries the http status and Retry-After."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class SearchLimiter:
+    """Global in-flight cap plus a bounded concurrency queue per project."""
+
+    def __init__(self,
+                 max_in_flight: int,
+                 project_concurrency: int,
+                 project_queue_size: int,
+                 queue_timeout: float,
+                 retry_after: int):
+        self.max_in_flight = max_in_flight
+        self.project_concurrency = project_concurrency
+        self.project_queue_size = project_queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.in_flight = 0
+        self.project_semaphores = {}
+        self.project_admitted = {}
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "projects": {
+                project_name: {
+                    "running": min(admitted, self.project_concurrency),
+                    "waiting": max(admitted - self.project_concurrency, 0),
+                }
+                for project_name, admitted in self.project_admitted.items()
+            },
+        }
+
+    def check(self, project_name: str):
+        """Raise LimitExceeded when a search of the project would not be admitted right now."""
+        # everything here runs on the event loop, so plain counters are safe
+        if self.in_flight >= self.max_in_flight:
+            raise LimitExceeded("Server is busy, please retry later.", 503, self.retry_after)
+
+        if self.project_admitted.get(project_name, 0) >= self.project_concurrency + self.project_queue_size:
+            raise LimitExceeded(f"Too many requests for project {project_name}.", 429, self.retry_after)
+
+    @asynccontextmanager
+    async def limit(self, project_name: str):
+        self.check(project_name)
+
+        if project_name not in self.project_semaphores:
+            self.project_semaphores[project_name] = asyncio.Semaphore(self.project_concurrency)
+            self.project_admitted[project_name] = 0
+        semaphore = self.project_semaphores[project_name]
+
+        self.in_flight += 1
+        self.project_admitted[project_name] += 1
+        try:
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise LimitExceeded(f"Too many requests for project {project_name}.", 429, self.retry_after)
+
+            try:
+                yield
+            finally:
+                semaphore.release()
+        finally:
+            self.project_admitted[project_name] -= 1
+            self.in_flight -= 1
+
+
+search_limiter = SearchLimiter(
+    max_in_flight=config.api_max_in_flight,
+    project_concurrency=config.api_project_concurrency,
+    project_queue_size=config.api_project_queue_size,
+    queue_timeout=config.api_queue_timeout,
+    retry_after=config.api_retry_after,
+)
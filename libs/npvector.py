@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+from typing import Any
+
+import numpy as np
+from graphrag.model.types import TextEmbedder
+from graphrag.vector_stores.base import (
+    BaseVectorStore,
+    VectorStoreDocument,
+    VectorStoreSearchResult,
+)
+
+from libs.common import debug
+from libs.index_manifest import get_output_dir
+
+# (matrix file, inode, mtime_ns) -> loaded collection, shared by every store of the process
+np_collections = {}
+np_collections_lock = threading.Lock()
+
+
+def get_np_vector_dir(project_name: str):
+    return get_output_dir(project_name) / "vector_store"
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """float32 rows scaled to unit length, so a dot product is the cosine similarity."""
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return np.ascontiguousarray(matrix / norms)
+
+
+class NpCollection:
+    """Normalized vectors (memory-mapped) plus ids, texts and attributes of one collection."""
+
+    def __init__(self, matrix: np.ndarray, ids: list[str], texts: list[str], attributes: list[dict]):
+        self.matrix = matrix
+        self.ids = ids
+        self.texts = texts
+        self.attributes = attributes
+        self.rows = {id: row for row, id in enumerate(ids)}
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 0), dtype=np.float32), [], [], [])
+
+
+class NpVectorStore(BaseVectorStore):
+    """In-process vector storage: brute-force cosine search over a float32 matrix in a .npy file.
+
+    Fast enough for tens of thousands of entities and needs no external service.
+    """
+
+    def connect(self, **kwargs: Any) -> Any:
+        """Connect to the vector storage."""
+        self.db_uri = str(kwargs.get("db_uri", "/data/npvector"))
+        os.makedirs(self.db_uri, exist_ok=True)
+        self.matrix_file = os.path.join(self.db_uri, f"{self.collection_name}.npy")
+        self.documents_file = os.path.join(self.db_uri, f"{self.collection_name}.json")
+
+    def get_collection(self) -> NpCollection:
+        if not os.path.exists(self.matrix_file) or not os.path.exists(self.documents_file):
+            return NpCollection.empty()
+
+        # every write replaces the file, a new inode marks a new version even within one mtime tick
+        stat = os.stat(self.matrix_file)
+        key = (self.matrix_file, stat.st_ino, stat.st_mtime_ns)
+        with np_collections_lock:
+            collection = np_collections.get(key)
+            if collection is not None:
+                return collection
+
+            with open(self.documents_file, "r") as f:
+                documents = json.load(f)
+            collection = NpCollection(
+                matrix=np.load(self.matrix_file, mmap_mode="r"),
+                ids=documents["ids"],
+                texts=documents["texts"],
+                attributes=documents["attributes"],
+            )
+            # older versions of this collection are no longer read
+            for old_key in [old_key for old_key in np_collections if old_key[0] == self.matrix_file]:
+                del np_collections[old_key]
+            np_collections[key] = collection
+            return collection
+
+    def write_collection(self, matrix: np.ndarray, ids: list[str], texts: list[str], attributes: list[dict]):
+        # documents first, a reader keys on the matrix file and must find matching documents
+        tmp_documents_file = f"{self.documents_file}.tmp"
+        with open(tmp_documents_file, "w") as f:
+            json.dump({"ids": ids, "texts": texts, "attributes": attributes}, f, ensure_ascii=False)
+        os.replace(tmp_documents_file, self.documents_file)
+
+        tmp_matrix_file = f"{self.matrix_file}.tmp.npy"
+        np.save(tmp_matrix_file, np.ascontiguousarray(matrix, dtype=np.float32))
+        os.replace(tmp_matrix_file, self.matrix_file)
+
+    def load_documents(
+            self, documents: list[VectorStoreDocument], overwrite: bool = True
+    ) -> None:
+        """Load documents into vector storage, without `overwrite` as an upsert by id."""
+        # keyed by id, a document listed twice lands once (the last one wins)
+        raws = {}
+        for document in documents:
+            if document.vector is not None:
+                raws[str(document.id)] = document
+
+        if overwrite:
+            ids, texts, attributes, vectors = [], [], [], []
+        else:
+            collection = self.get_collection()
+            kept = [row for row, id in enumerate(collection.ids) if id not in raws]
+            ids = [collection.ids[row] for row in kept]
+            texts = [collection.texts[row] for row in kept]
+            attributes = [collection.attributes[row] for row in kept]
+            vectors = [collection.matrix[kept]] if kept else []
+
+        if raws:
+            ids.extend(raws.keys())
+            texts.extend(document.text for document in raws.values())
+            attributes.extend(document.attributes for document in raws.values())
+            vectors.append(normalize_rows([document.vector for document in raws.values()]))
+
+        matrix = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        self.write_collection(matrix, ids, texts, attributes)
+        debug(f"Stored {len(ids)} vectors in {self.matrix_file}")
+
+    def filter_by_id(self, include_ids: list[str] | list[int]) -> Any:
+        """Build a query filter to filter documents by id."""
+        if len(include_ids) == 0:
+            self.query_filter = None
+        else:
+            self.query_filter = [str(id) for id in include_ids]
+        return self.query_filter
+
+    def candidate_rows(self, collection: NpCollection, attributes_filter: dict | None):
+        """Rows allowed by `filter_by_id` and an attributes filter, None when all rows are."""
+        if not self.query_filter and not attributes_filter:
+            return None
+
+        if self.query_filter:
+            rows = [collection.rows[id] for id in dict.fromkeys(self.query_filter) if id in collection.rows]
+        else:
+            rows = range(len(collection.ids))
+        if attributes_filter:
+            rows = [
+                row for row in rows
+                if all((collection.attributes[row] or {}).get(key) == value for key, value in attributes_filter.items())
+            ]
+        return np.asarray(rows, dtype=np.int64)
+
+    def similarity_search_by_vector(
+            self, query_embedding: list[float], k: int = 10, **kwargs: Any
+    ) -> list[VectorStoreSearchResult]:
+        """Perform a vector-based similarity search.
+
+        `filter_by_id` ids and an `attributes_filter` dict (equal top-level values) narrow the
+        rows searched. Vectors are only returned with `include_vector=True`.
+        """
+        return self.similarity_search_by_vectors([query_embedding], k, **kwargs)[0]
+
+    def similarity_search_by_vectors(
+            self, query_embeddings: list[list[float]], k: int = 10, **kwargs: Any
+    ) -> list[list[VectorStoreSearchResult]]:
+        """Search many query vectors with one matrix product, one result list per query in input order."""
+        if len(query_embeddings) == 0:
+            return []
+
+        collection = self.get_collection()
+        rows = self.candidate_rows(collection, kwargs.get("attributes_filter"))
+        matrix = collection.matrix if rows is None else collection.matrix[rows]
+        count = min(k, len(matrix))
+        if count <= 0:
+            return [[] for _ in query_embeddings]
+
+        scores = normalize_rows(query_embeddings) @ matrix.T
+        # top k per query without sorting every score, then only those k are ordered
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        top = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+
+        include_vector = kwargs.get("include_vector", False)
+        docs = []
+        for query, positions in enumerate(top):
+            results = []
+            for position in positions:
+                row = int(position) if rows is None else int(rows[position])
+                results.append(VectorStoreSearchResult(
+                    document=self.to_document(collection, row, include_vector),
+                    score=float(scores[query, position]),
+                ))
+            docs.append(results)
+        return docs
+
+    def to_document(self, collection: NpCollection, row: int, include_vector: bool = True) -> VectorStoreDocument:
+        return VectorStoreDocument(
+            id=collection.ids[row],
+            text=collection.texts[row],
+            vector=collection.matrix[row].tolist() if include_vector else None,
+            attributes=collection.attributes[row],
+        )
+
+    def similarity_search_by_text(
+            self, text: str, text_embedder: TextEmbedder, k: int = 10, **kwargs: Any
+    ) -> list[VectorStoreSearchResult]:
+        """Perform a similarity search using a given input text."""
+
+        query_embedding = text_embedder(text)
+
+        if query_embedding:
+            return self.similarity_search_by_vector(query_embedding, k, **kwargs)
+        return []
+
+    def count_documents(self) -> int:
+        return len(self.get_collection().ids)
+
+    def delete_documents(self, ids: list[str]) -> None:
+        collection = self.get_collection()
+        removed = {str(id) for id in ids}
+        kept = [row for row, id in enumerate(collection.ids) if id not in removed]
+        self.write_collection(
+            collection.matrix[kept] if kept else np.zeros((0, 0), dtype=np.float32),
+            [collection.ids[row] for row in kept],
+            [collection.texts[row] for row in kept],
+            [collection.attributes[row] for row in kept],
+        )
+        debug(f"Deleted {len(collection.ids) - len(kept)} items")
+
+    def search_by_id(self, id: str) -> VectorStoreDocument:
+        """Search for a document by id."""
+        collection = self.get_collection()
+        row = collection.rows.get(str(id))
+        if row is None:
+            return VectorStoreDocument(id=id, text=None, vector=None)
+        return self.to_document(collection, row)
+
+
+def get_np_vector_store(project_name: str):
+    """The project's entity description embeddings, as written by Store Vector."""
+    embedding_store = NpVectorStore(
+        collection_name=f"entity_embeddings_{project_name}",
+    )
+    embedding_store.connect(
+        db_uri=get_np_vector_dir(project_name),
+    )
+    return embedding_store
@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable
+
+
+class Stage:
+    """One pipeline stage: `fn(item)` run by `workers` threads reading a bounded input queue.
+
+    The first stage's items come from the pipeline source instead, `fn` is then unused.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Any], Any] | None, workers: int, queue_size: int):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.lock = threading.Lock()
+        self.running_workers = 0
+        self.done = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, started_at: float, ok: bool):
+        with self.lock:
+            self.busy += time.time() - started_at
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def stats(self):
+        with self.lock:
+            elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "queued": self.queue.qsize(),
+                "done": self.done,
+                "failed": self.failed,
+                "per_second": round(self.done / elapsed, 2) if elapsed > 0 else 0,
+                "busy_seconds": round(self.busy, 1),
+            }
+
+
+def run_pipeline(
+        source: Iterable,
+        stages: list[Stage],
+        report: Callable[[list[dict]], None] = None,
+        report_interval: float = 1.0,
+):
+    """Stream `source` items through `stages`, every stage on its own threads.
+
+    Bounded queues between stages hold back a fast stage when the next one falls
+    behind. `stages[0]` only counts what the source yields, each later stage passes
+    what `fn` returns to the next one. Returns what the last stage returned (in
+    completion order) and [(item, stage name, exception)] of items that failed,
+    they go no further. `report` is called with the stats of every stage from the
+    calling thread, so it may draw on streamlit.
+    """
+    results = []
+    errors = []
+    results_lock = threading.Lock()
+    finished = threading.Event()
+    source_stage, worker_stages = stages[0], stages[1:]
+
+    def put_sentinels(index: int):
+        if index == len(worker_stages):
+            finished.set()
+            return
+        for _ in range(worker_stages[index].workers):
+            worker_stages[index].queue.put(None)
+
+    def feed():
+        source_stage.started_at = time.time()
+        iterator = iter(source)
+        while True:
+            started_at = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            except Exception as e:
+                # the source can not go on after raising, stop feeding
+                with results_lock:
+                    errors.append((None, source_stage.name, e))
+                break
+            source_stage.record(started_at, ok=True)
+            if worker_stages:
+                worker_stages[0].queue.put(item)
+        source_stage.finished_at = time.time()
+        put_sentinels(0)
+
+    def work(index: int):
+        stage = worker_stages[index]
+        while True:
+            item = stage.queue.get()
+            if item is None:
+                break
+            started_at = time.time()
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                stage.record(started_at, ok=False)
+                with results_lock:
+                    errors.append((item, stage.name, e))
+                continue
+            stage.record(started_at, ok=True)
+            if index + 1 < len(worker_stages):
+                worker_stages[index + 1].queue.put(result)
+            else:
+                with results_lock:
+                    results.append(result)
+
+        # the last worker out closes the next stage
+        with stage.lock:
+            stage.running_workers -= 1
+            last = stage.running_workers == 0
+            if last:
+                stage.finished_at = time.time()
+        if last:
+            put_sentinels(index + 1)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, stage in enumerate(worker_stages):
+        stage.started_at = time.time()
+        stage.running_workers = stage.workers
+        threads.extend(threading.Thread(target=work, args=(index,), daemon=True) for _ in range(stage.workers))
+    for thread in threads:
+        thread.start()
+
+    while not finished.wait(timeout=report_interval):
+        if report:
+            report([stage.stats() for stage in stages])
+
+    if report:
+        report([stage.stats() for stage in stages])
+    return results, errors
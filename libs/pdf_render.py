@@ -0,0 +1,72 @@
+import concurrent.futures
+import multiprocessing
+import os
+
+import fitz
+
+import libs.config as config
+
+
+def get_page_image_path(base_dir: str, pdf_name: str, page_num: int):
+    return f"{base_dir}/{pdf_name}_page_{page_num + 1}.png"
+
+
+def get_render_workers(range_count: int):
+    """Worker processes for rasterization, PDF_RENDER_WORKERS=0 uses every CPU."""
+    workers = config.pdf_render_workers or os.cpu_count() or 1
+    return max(1, min(workers, range_count))
+
+
+def split_page_ranges(page_nums: list[int], range_size: int):
+    page_nums = sorted(page_nums)
+    return [page_nums[start:start + range_size] for start in range(0, len(page_nums), range_size)]
+
+
+def render_page_range(pdf_path: str, base_dir: str, page_nums: list[int], dpi: int):
+    """Render pages to png and return their text, {page_num: page_txt}.
+
+    Runs in a worker process that opens the document itself, fitz documents are
+    not safe to share between threads. Pages that fail to render are left out.
+    """
+    pdf_name = os.path.basename(pdf_path)
+    pages = {}
+    with fitz.open(pdf_path) as doc:
+        for page_num in page_nums:
+            try:
+                page = doc.load_page(page_num)
+                page.get_pixmap(dpi=dpi).save(get_page_image_path(base_dir, pdf_name, page_num))
+                pages[page_num] = page.get_text("text")
+            except Exception as e:
+                print(f"{pdf_name} page {page_num + 1} failed to render: {e}")
+    return pages
+
+
+def iter_rendered_pages(pdf_path: str, base_dir: str, page_nums: list[int]):
+    """Render pages in a process pool, yielding {page_num: page_txt} per page range as ranges finish.
+
+    Only a few ranges per worker are submitted ahead, so a slow consumer holds rendering back.
+    """
+    ranges = split_page_ranges(page_nums, config.pdf_render_range_size)
+    if len(ranges) == 0:
+        return
+
+    workers = get_render_workers(len(ranges))
+    # spawn, forking the threaded streamlit process is not safe
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        ranges = iter(ranges)
+        pending = set()
+        while True:
+            while len(pending) < workers * 2:
+                page_range = next(ranges, None)
+                if page_range is None:
+                    break
+                pending.add(executor.submit(render_page_range, pdf_path, base_dir, page_range, config.pdf_render_dpi))
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
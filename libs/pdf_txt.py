@@ -1,23 +1,52 @@
 import fitz
-from openai import AzureOpenAI
 import os
 import base64
+import hashlib
+import json
+import random
+import time
 import streamlit as st
 from libs.blob import upload_file
+from libs.pdf_render import get_page_image_path, get_render_workers, iter_rendered_pages, split_page_ranges
+from libs.pdf_pipeline import Stage, run_pipeline
 from libs.save_settings import get_setting_file
+from libs.source_index import index_page, remove_pdf_pages
 import libs.config as config
-import concurrent.futures
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.formrecognizer import DocumentAnalysisClient
-
-client = AzureOpenAI(
-    api_version=config.data_azure_api_version,
-    azure_endpoint=config.data_azure_api_base,
-    azure_deployment=config.data_azure_chat_deployment_name,
-    api_key=config.data_azure_api_key,
+from libs.extract_client import extract_client
+from libs.common import generate_text_fingerprint
+from libs.index_manifest import hash_file
+from libs.result_cache import ResultCache
+
+
+# extracted page text by page content, prompt and model, shared by every project
+page_cache = ResultCache(
+    ttl=config.page_cache_ttl,
+    max_bytes=config.page_cache_max_bytes,
+    db_path=config.page_cache_db,
 )
 
 
+def make_page_cache_key(img_path: str, pdf_vision_option: str, prompt: str):
+    with open(img_path, "rb") as f:
+        page_hash = hashlib.sha256(f.read()).hexdigest()
+    if pdf_vision_option == config.generate_data_vision_di:
+        model = {"model": "prebuilt-read"}
+    else:
+        # the deployment extract_client actually calls, a new model behind it changes the text
+        model = {
+            "endpoint": config.data_azure_api_base,
+            "deployment": config.data_azure_chat_deployment_name,
+            "model": config.data_azure_chat_model_id,
+            "api_version": config.data_azure_api_version,
+        }
+    return generate_text_fingerprint(json.dumps({
+        "page": page_hash,
+        "pdf_vision_option": pdf_vision_option,
+        "prompt": generate_text_fingerprint(prompt),
+        "model": model,
+    }, sort_keys=True))
+
+
 def image_to_base64(image_path:str):
     with open(image_path, "rb") as image_file:
         base64_encoded = base64.b64encode(image_file.read()).decode("utf-8")
@@ -26,102 +55,94 @@ def image_to_base64(image_path:str):
 
 class PageTask:
 
-    def __init__(self, doc, pdf_path, project_name, pdf_vision_option, page_num):
-        self.doc = doc
+    def __init__(self, pdf_path, project_name, pdf_vision_option, page_num, page_count, page_txt=None):
         self.pdf_name = os.path.basename(pdf_path)
         self.project_name = project_name
         self.pdf_vision_option = pdf_vision_option
         self.pdf_vision_option_format = pdf_vision_option.replace(" ", "")
         self.base_name = f"/app/projects/{project_name}/pdf_cache"
-        self.img_path = f"{self.base_name}/{self.pdf_name}_page_{page_num + 1}.png"
+        self.img_path = get_page_image_path(self.base_name, self.pdf_name, page_num)
         self.txt_path = f"{self.base_name}/{self.pdf_name}_page_{page_num + 1}.png.txt"
         self.ai_txt_path = f"{self.base_name}/{self.pdf_name}_page_{page_num + 1}.png.{self.pdf_vision_option_format}.txt"
         self.page_num = page_num
+        self.page_count = page_count
+        # image and text come from the rasterization stage (libs.pdf_render)
+        self.page_txt = page_txt
     
-    def page_to_image(self):
-        page = self.doc.load_page(self.page_num)
-        pix = page.get_pixmap(dpi=150)
-        pix.save(self.img_path)
+    def upload_image(self):
+        if self.page_txt is None:
+            raise Exception(f"page {self.page_num + 1} was not rendered")
         upload_file(self.project_name, self.img_path)
 
     def page_to_txt(self):
-        page_txt = self.doc[self.page_num].get_text("text")
-        # with open(self.txt_path, "w") as txt_file:
-        #     txt_file.write(page_txt)
-        #     st.write(f"[{self.page_num}/{self.doc.page_count}] {self.txt_path}")
-        return page_txt
+        return self.page_txt
     
-    def get_ai_txt(self):
-        # use cache if exists
-        if os.path.exists(self.ai_txt_path):
-            with open(self.ai_txt_path, "r") as f:
-                return "", f.read()
-
-        self.page_to_image()
-        
-        prompt, ai_txt = "", ""
-        
-        try:
-            if self.pdf_vision_option == config.generate_data_vision:
-                prompt, ai_txt = self.gpt_vision_txt()
-            
-            if self.pdf_vision_option == config.generate_data_vision_txt:
-                prompt, ai_txt = self.gpt_vision_txt_by_txt()
-            
-            if self.pdf_vision_option == config.generate_data_vision_image:
-                prompt, ai_txt = self.gpt_vision_txt_by_image()
-
-            if self.pdf_vision_option == config.generate_data_vision_azure:
-                prompt, ai_txt = self.gpt_vision_txt_azure()
-                
-            if self.pdf_vision_option == config.generate_data_vision_di:
-                ai_txt = di_analyze_read(self.img_path)
-        
-            # set cache
-            with open(self.ai_txt_path, "w") as txt_file:
-                txt_file.write(ai_txt)
-                st.write(f"[{self.page_num}/{self.doc.page_count}] {self.ai_txt_path}")
-        except Exception as e:
-            st.warning(f"[{self.page_num}/{self.doc.page_count}] `{self.pdf_name}` generated an exception: {e}")
-        
-        return prompt, ai_txt
-
-    def gpt_vision_txt_azure(self):
-        base64_string = image_to_base64(self.img_path)
-
-        prompt = config.pdf_gpt_vision_prompt_azure.format(page_txt=self.page_to_txt())
-
-        completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                                "url": f"data:image/png;base64,{base64_string}" ,
-                            }
-                        },
-                    ]
-                }
-                
-            ],
-            model=config.azure_chat_model_id,
-        )
-        ai_txt = completion.choices[0].message.content
-
-        return prompt, ai_txt
-
-    def gpt_vision_txt(self):
+    def read_ai_txt(self):
+        """Cached text of the page, None when it has not been extracted yet."""
+        if not os.path.exists(self.ai_txt_path):
+            return None
+        with open(self.ai_txt_path, "r") as f:
+            ai_txt = f.read()
+        index_page(self.project_name, self.ai_txt_path, ai_txt)
+        return ai_txt
+
+    def extract(self):
+        """Run the vision option on the uploaded page image and cache the text, errors are raised.
+
+        Identical pages under the same prompt and model are only sent once, across
+        documents and projects. Returns (page_num, ai_txt).
+        """
+        prompt = self.get_prompt()
+        cache_key = make_page_cache_key(self.img_path, self.pdf_vision_option, prompt)
+        cached = page_cache.get(cache_key)
+        cached_txt = cached.get("ai_txt") if cached is not None else None
+
+        if cached_txt:
+            ai_txt = cached_txt
+        elif self.pdf_vision_option == config.generate_data_vision_di:
+            ai_txt = di_analyze_read(self.img_path)
+        else:
+            ai_txt = self.gpt_vision_txt(prompt)
+
+        # e.g. a content filtered reply, the page is failed and retried
+        if ai_txt is None:
+            raise Exception(f"page {self.page_num + 1} returned no text")
+
+        # set cache
+        with open(self.ai_txt_path, "w") as txt_file:
+            txt_file.write(ai_txt)
+            st.write(f"[{self.page_num}/{self.page_count}] {self.ai_txt_path}")
+        index_page(self.project_name, self.ai_txt_path, ai_txt)
+
+        # only text that made it to disk, an empty reply is asked again next time
+        if ai_txt and not cached_txt:
+            page_cache.set(cache_key, {"ai_txt": ai_txt})
+
+        return self.page_num, ai_txt
+
+    def get_prompt(self):
+        """Prompt of the vision option for this page, empty for Document Intelligence."""
+        if self.pdf_vision_option == config.generate_data_vision:
+            settings_file = f"/app/projects/{self.project_name}/prompts/pdf_gpt_vision_prompt.txt"
+            return get_setting_file(settings_file, config.pdf_gpt_vision_prompt).format(page_txt=self.page_to_txt())
+
+        if self.pdf_vision_option == config.generate_data_vision_txt:
+            settings_file = f"/app/projects/{self.project_name}/prompts/pdf_gpt_vision_prompt_by_text.txt"
+            return get_setting_file(settings_file, config.pdf_gpt_vision_prompt_by_text).format(page_txt=self.page_to_txt())
+
+        if self.pdf_vision_option == config.generate_data_vision_image:
+            settings_file = f"/app/projects/{self.project_name}/prompts/pdf_gpt_vision_prompt_by_image.txt"
+            return get_setting_file(settings_file, config.pdf_gpt_vision_prompt_by_image).format(page_txt=self.page_to_txt())
+
+        if self.pdf_vision_option == config.generate_data_vision_azure:
+            return config.pdf_gpt_vision_prompt_azure.format(page_txt=self.page_to_txt())
+
+        return ""
+
+    def gpt_vision_txt(self, prompt: str):
         base64_string = image_to_base64(self.img_path)
-        settings_file = f"/app/projects/{self.project_name}/prompts/pdf_gpt_vision_prompt.txt"
-        prompt = get_setting_file(settings_file, config.pdf_gpt_vision_prompt).format(page_txt=self.page_to_txt())
 
-        completion = client.chat.completions.create(
+        completion = extract_client.chat_completion(
             messages=[
                 {
                     "role": "user",
@@ -142,70 +163,7 @@ class PageTask:
             ],
             model=config.azure_chat_model_id,
         )
-        ai_txt = completion.choices[0].message.content
-
-        return prompt, ai_txt
-
-    def gpt_vision_txt_by_txt(self):
-        base64_string = image_to_base64(self.img_path)
-        settings_file = f"/app/projects/{self.project_name}/prompts/pdf_gpt_vision_prompt_by_text.txt"
-        prompt = get_setting_file(settings_file, config.pdf_gpt_vision_prompt_by_text).format(page_txt=self.page_to_txt())
-
-        completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                    "type": "text",
-                    "text": prompt
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                            "url": f"data:image/png;base64,{base64_string}" ,
-                        }
-                    },
-                    ]
-                }
-                
-            ],
-            model=config.azure_chat_model_id,
-        )
-        ai_txt = completion.choices[0].message.content
-
-        return prompt, ai_txt
-
-    def gpt_vision_txt_by_image(self):
-        base64_string = image_to_base64(self.img_path)
-        
-        settings_file = f"/app/projects/{self.project_name}/prompts/pdf_gpt_vision_prompt_by_image.txt"
-        prompt = get_setting_file(settings_file, config.pdf_gpt_vision_prompt_by_image).format(page_txt=self.page_to_txt())
-        
-        completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                    "type": "text",
-                    "text": prompt
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                            "url": f"data:image/png;base64,{base64_string}" ,
-                        }
-                    },
-                    ]
-                }
-                
-            ],
-            model=config.azure_chat_model_id,
-        )
-        ai_txt = completion.choices[0].message.content
-
-        return prompt, ai_txt
+        return completion.choices[0].message.content
 
     
 def save_pdf_pages_as_images(pdf_path:str, project_name:str, pdf_vision_option: str):
@@ -214,36 +172,178 @@ def save_pdf_pages_as_images(pdf_path:str, project_name:str, pdf_vision_option:
     base_dir = f"/app/projects/{project_name}/pdf_cache"
     os.makedirs(base_dir, exist_ok=True)
 
-    doc = fitz.open(pdf_path)
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
     
     upload_file(project_name, pdf_path)
+    clear_replaced_pages(project_name, base_dir, pdf_path)
+
+    tasks = [PageTask(pdf_path, project_name, pdf_vision_option, page_num, page_count) for page_num in range(page_count)]
+    page_txts = [pt.read_ai_txt() for pt in tasks]
+
+    # pages without cached text: render -> upload -> vision/DI, each stage on its own workers
+    pending = [page_num for page_num, ai_txt in enumerate(page_txts) if ai_txt is None]
+    if pending:
+        failed_pages_file = get_failed_pages_file(pdf_path, project_name, pdf_vision_option)
+        failed = read_failed_pages(failed_pages_file)
+
+        extracted, errors = run_page_pipeline(pdf_path, base_dir, tasks, pending, pdf_vision_option)
+        for attempt in range(config.pdf_page_max_retries + 1):
+            for page_num, ai_txt in extracted.items():
+                page_txts[page_num] = ai_txt
+                failed.pop(str(page_num), None)
+            for page_num, (stage, e) in errors.items():
+                page = failed.setdefault(str(page_num), {"attempts": 0})
+                page.update({"stage": stage, "error": str(e), "failed_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+                page["attempts"] += 1
+
+            if not errors or attempt == config.pdf_page_max_retries:
+                break
+
+            # only the failed pages go again, after a growing pause for throttled services
+            delay = config.pdf_page_retry_backoff * 2 ** attempt + random.uniform(0, 1)
+            st.write(f"`{pdf_file_name}` retrying {len(errors)} failed pages in {delay:.0f}s")
+            time.sleep(delay)
+            extracted, errors = run_page_pipeline(pdf_path, base_dir, tasks, sorted(errors), pdf_vision_option)
+
+        write_failed_pages(failed_pages_file, pdf_path, pdf_vision_option, failed)
+        for page_num, page in sorted(failed.items(), key=lambda item: int(item[0])):
+            st.warning(f"[{page_num}/{page_count}] `{pdf_file_name}` {page['stage']} failed {page['attempts']} times: {page['error']}")
+
+    # write full txt by order, failed pages stay empty until they are retried
+    tmp_file = f"{pdf_ai_txt_path}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write("\n" + "".join("\n\n" + (ai_txt or "") for ai_txt in page_txts))
+    os.replace(tmp_file, pdf_ai_txt_path)
+
+
+def clear_replaced_pages(project_name: str, base_dir: str, pdf_path: str):
+    """Drop the page files of an earlier, different PDF uploaded under the same name.
+
+    Page files are named after the PDF, the content hash recorded next to them tells
+    whether they still belong to it. Unchanged pages come back from the page cache.
+    A PDF without a recorded hash (extracted before hashes were kept) is taken as
+    unchanged, its pages are kept and the hash recorded.
+    """
+    pdf_name = os.path.basename(pdf_path)
+    pdf_hash = hash_file(pdf_path)
+    pdf_hash_file = f"{base_dir}/{pdf_name}.sha256"
+
+    if os.path.exists(pdf_hash_file):
+        with open(pdf_hash_file, "r") as f:
+            previous_hash = f.read().strip()
+        if previous_hash == pdf_hash:
+            return
+
+        for file in os.listdir(base_dir):
+            if file.startswith(f"{pdf_name}_page_") or (file.startswith(f"{pdf_name}.") and file.endswith(".failed.json")):
+                os.remove(os.path.join(base_dir, file))
+        # sources must not resolve to pages that are gone
+        remove_pdf_pages(project_name, pdf_name)
+
+    with open(pdf_hash_file, "w") as f:
+        f.write(pdf_hash)
+
+
+def get_failed_pages_file(pdf_path: str, project_name: str, pdf_vision_option: str):
+    pdf_name = os.path.basename(pdf_path)
+    return f"/app/projects/{project_name}/pdf_cache/{pdf_name}.{pdf_vision_option.replace(" ", "")}.failed.json"
+
+
+def read_failed_pages(failed_pages_file: str):
+    if not os.path.exists(failed_pages_file):
+        return {}
+    try:
+        with open(failed_pages_file, "r") as f:
+            return json.load(f)["pages"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def write_failed_pages(failed_pages_file: str, pdf_path: str, pdf_vision_option: str, failed: dict):
+    """Pages still without text after the retries, removed once every page went through."""
+    if not failed:
+        if os.path.exists(failed_pages_file):
+            os.remove(failed_pages_file)
+        return
+
+    tmp_file = f"{failed_pages_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"pdf_path": pdf_path, "pdf_vision_option": pdf_vision_option, "pages": failed}, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_file, failed_pages_file)
+
+
+def list_failed_pages(project_name: str):
+    """Manifests of the project's PDFs with failed pages, [(pdf_path, pdf_vision_option, pages)]."""
+    base_dir = f"/app/projects/{project_name}/pdf_cache"
+    if not os.path.exists(base_dir):
+        return []
 
-    def process_page(page_num):
-        pt = PageTask(doc, pdf_path, project_name, pdf_vision_option, page_num)
-        return pt.get_ai_txt()
-    
-    # get txt by parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_to_page = {executor.submit(process_page, page_num): page_num for page_num in range(doc.page_count)}
-        for future in concurrent.futures.as_completed(future_to_page):
-            page_num = future_to_page[future]
-            try:
-                future.result()
-                st.write(f"[{page_num}/{doc.page_count}] `{pdf_file_name}` done")
-            except Exception as exc:
-                st.warning(f"[{page_num}/{doc.page_count}] `{pdf_file_name}` generated an exception: {exc}")
-
-    # write full txt by order
-    with open(pdf_ai_txt_path, "w") as f:
-        f.write("\n")
-
-    for page_num in range(doc.page_count):
-        pt = PageTask(doc, pdf_path, project_name, pdf_vision_option, page_num)
-        with open(pdf_ai_txt_path, "a") as f:
-            f.write("\n\n")
-            prompt, ai_txt = pt.get_ai_txt()
-            if ai_txt:
-                f.write(ai_txt)
+    manifests = []
+    for file in sorted(os.listdir(base_dir)):
+        if not file.endswith(".failed.json"):
+            continue
+        try:
+            with open(os.path.join(base_dir, file), "r") as f:
+                manifest = json.load(f)
+            manifests.append((manifest["pdf_path"], manifest["pdf_vision_option"], manifest["pages"]))
+        except (OSError, ValueError, KeyError):
+            continue
+    return manifests
+
+
+def run_page_pipeline(pdf_path: str, base_dir: str, tasks: list[PageTask], pending: list[int], pdf_vision_option: str):
+    """Render, upload and extract `pending` pages as overlapping stages with bounded queues in between.
+
+    Returns {page_num: ai_txt} of extracted pages in page order and {page_num: (stage, exception)}
+    of the pages that did not make it through.
+    """
+    queue_size = config.pdf_pipeline_queue_size
+
+    def rendered_pages():
+        for rendered in iter_rendered_pages(pdf_path, base_dir, pending):
+            for page_num, page_txt in rendered.items():
+                tasks[page_num].page_txt = page_txt
+                yield tasks[page_num]
+
+    def upload(pt: PageTask):
+        pt.upload_image()
+        return pt
+
+    stages = [
+        Stage("render", None, get_render_workers(len(split_page_ranges(pending, config.pdf_render_range_size))), queue_size),
+        Stage("upload", upload, config.pdf_upload_workers, queue_size),
+        Stage(pdf_vision_option, lambda pt: pt.extract(), config.pdf_vision_workers.get(pdf_vision_option, 5), queue_size),
+    ]
+
+    # a retry renders again, pages are not trusted to be rendered from an earlier pass
+    for page_num in pending:
+        tasks[page_num].page_txt = None
+
+    placeholder = st.empty()
+    budget_placeholder = st.empty()
+
+    def report(stage_stats: list[dict]):
+        placeholder.table(stage_stats)
+        # what each deployment has left of its rate budget, and whether a 429 paused it
+        budget_stats = extract_client.stats()
+        if budget_stats:
+            budget_placeholder.table(budget_stats)
+
+    results, pipeline_errors = run_pipeline(rendered_pages(), stages, report=report)
+
+    errors = {}
+    for pt, stage, e in pipeline_errors:
+        if pt is None:
+            # rendering broke off, the pages it did not reach are reported below
+            st.warning(f"`{os.path.basename(pdf_path)}` {stage} generated an exception: {e}")
+        else:
+            errors[pt.page_num] = (stage, e)
+    for page_num in pending:
+        if tasks[page_num].page_txt is None:
+            errors[page_num] = ("render", Exception("page was not rendered"))
+
+    return dict(sorted(results)), errors
 
 
 def format_bounding_box(bounding_box):
@@ -254,24 +354,14 @@ def format_bounding_box(bounding_box):
 
 def di_analyze_read(img_path: str):
 
-    endpoint = config.di_url
-    key = config.di_key
-
     # open the file
     with open(img_path, "rb") as file:
         file_data = file.read()
 
         # print(file_data)
 
-        document_analysis_client = DocumentAnalysisClient(
-            endpoint=endpoint, credential=AzureKeyCredential(key)
-        )
-        
-        poller = document_analysis_client.begin_analyze_document(
-                "prebuilt-read",
-                document=file_data
-                )
-        result = poller.result()
+        # one shared async client, throttled and retried per Document Intelligence quota
+        result = extract_client.analyze_read(file_data)
         
         for idx, style in enumerate(result.styles):
             print(
@@ -1,18 +1,160 @@
+import io
 import json
+import re
+import struct
 import time
 import os
+import threading
+import weakref
+from contextlib import contextmanager
 from typing import Any
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
 import streamlit as st
 import libs.config as config
-from libs.common import debug
+from libs.common import debug, generate_text_fingerprint
 from graphrag.model.types import TextEmbedder
-from graphrag.vector_stores import (
+from graphrag.vector_stores.base import (
     BaseVectorStore,
     VectorStoreDocument,
     VectorStoreSearchResult,
 )
 
+# one pool per dsn for the whole process, stores only borrow connections from it
+pg_pools = {}
+pg_pools_lock = threading.Lock()
+
+embedding_dimensions = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# pgvector can not build hnsw/ivfflat indexes over more dimensions than this
+max_index_dimensions = {
+    "vector": 2000,
+    "halfvec": 4000,
+}
+
+# pgvector rejects a larger hnsw.ef_search
+max_hnsw_ef_search = 1000
+
+# first pgvector release with hnsw.iterative_scan / ivfflat.iterative_scan
+iterative_scan_version = (0, 8, 0)
+
+# postgres keeps this many bytes of an identifier and silently drops the rest
+max_identifier_bytes = 63
+
+# names of the statements already prepared on each pooled connection, gone with the connection
+prepared_statements = weakref.WeakKeyDictionary()
+
+
+class BlockingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """A ThreadedConnectionPool that keeps up to `maxconn` idle connections and waits for a free one.
+
+    psycopg2 closes every returned connection beyond `minconn` idle ones and raises once
+    `maxconn` are borrowed. Here `minconn` are opened up front, more as load needs them,
+    and all of them stay open so their prepared statements are reused.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, **kwargs):
+        super().__init__(min(minconn, maxconn), maxconn, **kwargs)
+        # _putconn keeps a returned connection while fewer than `minconn` are idle
+        self.minconn = maxconn
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f"no connection free within {self.timeout}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self.slots.release()
+
+
+def get_pg_pool(db_params: dict):
+    key = tuple(sorted(db_params.items()))
+    with pg_pools_lock:
+        if key not in pg_pools:
+            pg_pools[key] = BlockingConnectionPool(
+                config.pg_pool_min_size,
+                config.pg_pool_max_size,
+                config.pg_pool_timeout,
+                **db_params,
+            )
+        return pg_pools[key]
+
+
+def get_relation_name(table_name: str, suffix: str) -> str:
+    """`{table_name}_{suffix}`, shortened with a hash of the full name when postgres would truncate it.
+
+    Truncated names could collide (e.g. a staging table with its live table) or stop matching
+    what the swap renames, so every table and index this store creates is named through here.
+    """
+    name = f"{table_name}_{suffix}"
+    if len(name.encode("utf-8")) <= max_identifier_bytes:
+        return name
+    fingerprint = generate_text_fingerprint(name)[:8]
+    prefix = table_name.encode("utf-8")[:max_identifier_bytes - len(suffix) - len(fingerprint) - 2].decode("utf-8", "ignore")
+    return f"{prefix}_{fingerprint}_{suffix}"
+
+
+def get_embedding_dimension(model_id: str = None) -> int:
+    """Vector dimension of the embedding model, PG_VECTOR_DIMENSION overrides it."""
+    if config.pg_vector_dimension > 0:
+        return config.pg_vector_dimension
+    return embedding_dimensions.get(model_id or config.azure_embedding_model_id, 1536)
+
+
+def to_vector_literal(vector: list[float]) -> str:
+    """pgvector's text input, each value rounded to the float32 it is stored as.
+
+    9 significant digits give back that exact float32, about a third shorter to send and
+    parse than the 17 digits a python float prints.
+    """
+    values = struct.unpack(f"{len(vector)}f", struct.pack(f"{len(vector)}f", *vector))
+    return "[" + ",".join(format(value, ".9g") for value in values) + "]"
+
+
+def encode_vector(vector: list[float], vector_type: str = "vector") -> bytes:
+    """pgvector's binary layout: dimension, an unused int16, then float32 (vector) or float16 (halfvec) values."""
+    value_format = "e" if vector_type == "halfvec" else "f"
+    return struct.pack(f">HH{len(vector)}{value_format}", len(vector), 0, *vector)
+
+
+def encode_copy_binary(rows: list[tuple], vector_type: str = "vector") -> io.BytesIO:
+    """Rows of (id, text, vector, attributes) in the COPY binary format."""
+    data = io.BytesIO()
+    data.write(b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0))
+    for id, text, vector, attributes in rows:
+        data.write(struct.pack(">h", 4))
+        values = (
+            str(id).encode("utf-8"),
+            text.encode("utf-8") if text is not None else None,
+            encode_vector(vector, vector_type),
+            # jsonb binary input is a version byte followed by the json text
+            b"\x01" + attributes.encode("utf-8"),
+        )
+        for value in values:
+            if value is None:
+                data.write(struct.pack(">i", -1))
+                continue
+            data.write(struct.pack(">i", len(value)))
+            data.write(value)
+    data.write(struct.pack(">h", -1))
+    data.seek(0)
+    return data
+
+
 class PgVectorStore(BaseVectorStore):
     """The Pg vector storage implementation."""
 
@@ -33,175 +175,476 @@ class PgVectorStore(BaseVectorStore):
             'port': port
         }
 
-        self.conn = psycopg2.connect(**db_params)
-        self.cur = self.conn.cursor()
+        self.pool = get_pg_pool(db_params)
+
+        self.vector_type = kwargs.get("vector_type", config.pg_vector_type)
+        self.vector_dimension = int(kwargs.get("vector_dimension", 0)) or get_embedding_dimension()
+
+        # ann index of the vector column, `none` keeps exact sequential scans
+        self.index_type = kwargs.get("index_type", config.pg_index_type)
+        self.hnsw_m = int(kwargs.get("hnsw_m", config.pg_hnsw_m))
+        self.hnsw_ef_construction = int(kwargs.get("hnsw_ef_construction", config.pg_hnsw_ef_construction))
+        self.hnsw_ef_search = int(kwargs.get("hnsw_ef_search", config.pg_hnsw_ef_search))
+        self.ivfflat_lists = int(kwargs.get("ivfflat_lists", config.pg_ivfflat_lists))
+        self.ivfflat_probes = int(kwargs.get("ivfflat_probes", config.pg_ivfflat_probes))
+        # whether the extension can keep scanning the index past filtered out rows, checked on first search
+        self.iterative_scan = None
+
+    @contextmanager
+    def cursor(self, autocommit: bool = False):
+        """A cursor on a pooled connection for one call, committed on success and rolled back on error."""
+        conn = self.pool.getconn()
+        broken = False
+        try:
+            # CREATE/DROP INDEX CONCURRENTLY can not run inside a transaction
+            conn.autocommit = autocommit
+            with conn.cursor() as cur:
+                yield cur
+            conn.commit()
+            conn.autocommit = False
+        except Exception as e:
+            # a dropped connection is closed instead of going back to the pool
+            broken = conn.closed != 0 or isinstance(e, psycopg2.OperationalError)
+            if conn.closed == 0:
+                conn.rollback()
+                conn.autocommit = False
+            raise
+        finally:
+            self.pool.putconn(conn, close=broken)
+            # the pool also closes connections it finds in an unknown state
+            if conn.closed != 0:
+                prepared_statements.pop(conn, None)
+
+    def execute_prepared(self, cur, sql: str, params: tuple):
+        """Run `sql` (with $1, $2 ... placeholders) as a server-side prepared statement of the connection.
+
+        psycopg2 only speaks the text protocol, so the parameters, query vectors included, are
+        quoted into `EXECUTE` client side and parsed by the server on every call; there is no
+        binary bind. Parsing one vector costs a fraction of a millisecond next to the index
+        scan it feeds, while the statement still skips parsing and planning the search SQL.
+        Binary binds would need psycopg 3 under the pool, COPY loader and every cursor here.
+        """
+        name = "stmt_" + generate_text_fingerprint(sql)[:16]
+        prepared = prepared_statements.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(f"PREPARE {name} AS {sql}")
+            prepared.add(name)
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
 
     def load_documents(
             self, documents: list[VectorStoreDocument], overwrite: bool = True
     ) -> None:
         """Load documents into vector storage."""
 
-        raws = []
+        # keyed by id, a document listed twice lands once (the last one wins)
+        raws = {}
         for document in documents:
             if document.vector is not None:
-                raws.append({
-                    "id": document.id,
-                    "text": document.text,
-                    "vector": document.vector,
-                    "attributes": json.dumps(document.attributes)
-                })
+                raws[document.id] = (
+                    document.id,
+                    document.text,
+                    document.vector,
+                    json.dumps(document.attributes),
+                )
 
-        if len(raws) == 0:
-            raws = None
+        # the vectors themselves are the truth, whatever model the project was embedded with
+        if raws:
+            self.vector_dimension = len(next(iter(raws.values()))[2])
 
+        self.create_vector()
         if overwrite:
-            if raws:
-                self.create_vector()
-                self.create_pg_table()
-                self.insert_data(raws)
-            else:
-                self.create_pg_table()
+            self.bulk_load(list(raws.values()))
         else:
+            self.create_pg_table()
             if raws:
-                self.insert_data(raws)
+                self.bulk_upsert(list(raws.values()))
 
     def create_vector(self):
         try:
             st.write("CREATE EXTENSION vector")
             sql = f"CREATE EXTENSION vector;"
-            self.cur.execute(sql)
-            self.conn.commit()
+            with self.cursor() as cur:
+                cur.execute(sql)
         except Exception as e:
-            self.conn.rollback()
+            pass
 
     def truncate_table(self):
         try:
             sql = f"TRUNCATE TABLE {self.collection_name};"
-            self.cur.execute(sql)
-            self.conn.commit()
+            with self.cursor() as cur:
+                cur.execute(sql)
         except Exception as e:
-            self.conn.rollback()
+            pass
 
     def drop_pg_table(self):
         drop_table_query = f"drop table {self.collection_name};"
 
         try:
-            self.cur.execute(drop_table_query)
-            self.conn.commit()
+            with self.cursor() as cur:
+                cur.execute(drop_table_query)
         except Exception as e:
-            self.conn.rollback()
             print(e)
             st.error(e)
 
-    def create_pg_table(self):
-        create_table_query = f"""
-CREATE TABLE IF NOT EXISTS {self.collection_name} (
-    id VARCHAR(255) PRIMARY KEY,
+    def table_schema(self, table_name: str):
+        return f"""
+CREATE TABLE IF NOT EXISTS {table_name} (
+    id VARCHAR(255) CONSTRAINT {get_relation_name(table_name, "pkey")} PRIMARY KEY,
     text TEXT,
-    vector vector(1536),
-    attributes TEXT
+    vector {self.vector_type}({self.vector_dimension}),
+    attributes JSONB
 );
+CREATE INDEX IF NOT EXISTS {get_relation_name(table_name, "attributes_idx")} ON {table_name} USING gin (attributes jsonb_path_ops);
 """
 
+    def create_pg_table(self):
         try:
-            self.cur.execute(create_table_query)
-            self.conn.commit()
+            with self.cursor() as cur:
+                cur.execute(self.table_schema(self.collection_name))
+            self.migrate_table()
         except Exception as e:
-            self.conn.rollback()
             print(e)
             st.error(e)
 
-    def insert_raws(self, rows) -> None:
-        query = f"INSERT INTO {self.collection_name} (id, text, vector, attributes) VALUES (%s, %s, %s, %s);"
+    def get_column_types(self, cur, table_name: str) -> dict:
+        cur.execute("""
+SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+FROM pg_attribute a
+WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped;
+""", (table_name,))
+        return dict(cur.fetchall())
 
-        try:
-            self.cur.executemany(query, rows)
-            self.conn.commit()
-            debug(f"Uploaded {len(rows)} items")
-        except Exception as e:
-            self.conn.rollback()
-            print(e)
-            st.error(e)
+    def migrate_table(self) -> list[str]:
+        """Bring a table created by an older schema to the configured one, returns what changed.
+
+        TEXT attributes become JSONB and the vector column is converted between vector and
+        halfvec in place. A different dimension can not be converted, the embeddings have to
+        be stored again.
+        """
+        changes = []
+        target_type = f"{self.vector_type}({self.vector_dimension})"
+
+        with self.cursor() as cur:
+            columns = self.get_column_types(cur, self.collection_name)
+
+            if columns.get("attributes") == "text":
+                cur.execute(f"ALTER TABLE {self.collection_name} ALTER COLUMN attributes TYPE jsonb USING attributes::jsonb;")
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {get_relation_name(self.collection_name, 'attributes_idx')} ON {self.collection_name} USING gin (attributes jsonb_path_ops);")
+                changes.append("attributes: text -> jsonb")
+
+            current_type = columns.get("vector")
+            if current_type and current_type != target_type:
+                current_dimension = int(re.search(r"\((\d+)\)", current_type).group(1))
+                if current_dimension != self.vector_dimension:
+                    raise ValueError(
+                        f"{self.collection_name} stores {current_dimension}-dimension vectors but {self.vector_dimension} are expected, "
+                        f"store the embeddings again to rebuild it."
+                    )
+                # the ann index is typed by its operator class, build it again for the new type
+                cur.execute(f"DROP INDEX IF EXISTS {self.vector_index_name(self.collection_name)};")
+                cur.execute(f"ALTER TABLE {self.collection_name} ALTER COLUMN vector TYPE {target_type} USING vector::{target_type};")
+                cur.execute(f"SELECT COUNT(*) FROM {self.collection_name};")
+                self.create_vector_index(cur, self.collection_name, cur.fetchone()[0])
+                changes.append(f"vector: {current_type} -> {target_type}")
+
+        for change in changes:
+            st.write(f"Migrated `{self.collection_name}` {change}")
+        return changes
+
+    def copy_rows(self, cur, table_name: str, rows: list[tuple]) -> None:
+        """Stream rows into `table_name` with binary COPY, in chunks to bound memory."""
+        for start in range(0, len(rows), config.pg_copy_batch_size):
+            data = encode_copy_binary(rows[start:start + config.pg_copy_batch_size], self.vector_type)
+            cur.copy_expert(f"COPY {table_name} (id, text, vector, attributes) FROM STDIN WITH (FORMAT binary)", data)
+            debug(f"Copied {min(start + config.pg_copy_batch_size, len(rows))}/{len(rows)} items")
+
+    def bulk_load(self, rows: list[tuple]) -> None:
+        """Replace the collection: load a staging table and swap it in, readers see the old rows until commit."""
+        staging_name = get_relation_name(self.collection_name, "staging")
+        started_at = time.time()
+
+        with self.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {staging_name};")
+            cur.execute(self.table_schema(staging_name))
+            self.copy_rows(cur, staging_name, rows)
+            # building the index once over the loaded rows beats maintaining it row by row
+            indexed = self.create_vector_index(cur, staging_name, len(rows))
+            cur.execute(f"DROP TABLE IF EXISTS {self.collection_name};")
+            cur.execute(f"ALTER TABLE {staging_name} RENAME TO {self.collection_name};")
+            # renaming the primary key index renames its constraint too
+            for suffix in ["pkey", "attributes_idx"]:
+                cur.execute(f"ALTER INDEX {get_relation_name(staging_name, suffix)} RENAME TO {get_relation_name(self.collection_name, suffix)};")
+            if indexed:
+                cur.execute(f"ALTER INDEX {self.vector_index_name(staging_name)} RENAME TO {self.vector_index_name(self.collection_name)};")
+
+        self.report_load(len(rows), started_at)
 
-    def insert_data(self, raws) -> None:
-        batch = []
-        for raw in raws:
-            current = (raw['id'], raw['text'], str(raw['vector']), raw['attributes'])
-            if len(batch) < 200:
-                batch.append(current)
+    def bulk_upsert(self, rows: list[tuple]) -> None:
+        """Add rows to the collection, rows whose id already exists are replaced."""
+        staging_name = get_relation_name(self.collection_name, "upsert")
+        started_at = time.time()
+
+        with self.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE {staging_name} (LIKE {self.collection_name}) ON COMMIT DROP;")
+            self.copy_rows(cur, staging_name, rows)
+            cur.execute(f"""
+INSERT INTO {self.collection_name} (id, text, vector, attributes)
+SELECT id, text, vector, attributes FROM {staging_name}
+ON CONFLICT (id) DO UPDATE SET text = EXCLUDED.text, vector = EXCLUDED.vector, attributes = EXCLUDED.attributes;
+""")
+            if not self.vector_index_exists(cur):
+                cur.execute(f"SELECT COUNT(*) FROM {self.collection_name};")
+                self.create_vector_index(cur, self.collection_name, cur.fetchone()[0])
+
+        self.report_load(len(rows), started_at)
+
+    def vector_index_name(self, table_name: str):
+        return get_relation_name(table_name, "vector_idx")
+
+    def vector_index_sql(self, table_name: str, index_name: str, rows: int, concurrently: bool = False):
+        if self.index_type == "hnsw":
+            method = "hnsw"
+            params = f"m = {self.hnsw_m}, ef_construction = {self.hnsw_ef_construction}"
+        elif self.index_type == "ivfflat":
+            method = "ivfflat"
+            params = f"lists = {self.get_ivfflat_lists(rows)}"
+        else:
+            raise ValueError(f"Unknown pgvector index type {self.index_type}")
+
+        return f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}{index_name} ON {table_name} USING {method} (vector {self.vector_type}_cosine_ops) WITH ({params});"
+
+    def get_ivfflat_lists(self, rows: int):
+        if self.ivfflat_lists > 0:
+            return self.ivfflat_lists
+        # pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) above
+        if rows <= 1000000:
+            return max(rows // 1000, 10)
+        return int(rows ** 0.5)
+
+    def can_index(self):
+        if self.index_type == "none":
+            return False
+        if self.vector_dimension > max_index_dimensions[self.vector_type]:
+            st.warning(f"{self.vector_dimension}-dimension {self.vector_type} columns can not be indexed, set PG_VECTOR_TYPE=halfvec to index them.")
+            return False
+        return True
+
+    def create_vector_index(self, cur, table_name: str, rows: int):
+        if not self.can_index():
+            return False
+        started_at = time.time()
+        cur.execute(self.vector_index_sql(table_name, self.vector_index_name(table_name), rows))
+        debug(f"Built {self.index_type} index on {table_name} in {time.time() - started_at:.2f}s")
+        return True
+
+    def vector_index_exists(self, cur):
+        cur.execute("SELECT 1 FROM pg_indexes WHERE tablename = %s AND indexname = %s;",
+                    (self.collection_name, self.vector_index_name(self.collection_name)))
+        return cur.fetchone() is not None
+
+    def index_status(self) -> dict:
+        """The vector index of the collection: definition, size and how often searches used it."""
+        index_name = self.vector_index_name(self.collection_name)
+        with self.cursor() as cur:
+            cur.execute("""
+SELECT i.indexdef,
+       pg_relation_size(c.oid),
+       COALESCE(s.idx_scan, 0),
+       ix.indisvalid
+FROM pg_indexes i
+JOIN pg_class c ON c.relname = i.indexname
+JOIN pg_index ix ON ix.indexrelid = c.oid
+LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = c.oid
+WHERE i.tablename = %s AND i.indexname = %s;
+""", (self.collection_name, index_name))
+            index = cur.fetchone()
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s;", (self.collection_name,))
+            table = cur.fetchone()
+
+        status = {
+            "collection_name": self.collection_name,
+            "index_name": index_name,
+            "configured_type": self.index_type,
+            "rows": max(table[0], 0) if table else 0,
+            "exists": index is not None,
+        }
+        if index is not None:
+            status.update({
+                "definition": index[0],
+                "size_bytes": index[1],
+                "scans": index[2],
+                "valid": index[3],
+            })
+        return status
+
+    def rebuild_index(self) -> dict:
+        """Build the vector index with the current settings next to the old one, then swap them.
+
+        Searches keep using the old index while the new one is built.
+        """
+        index_name = self.vector_index_name(self.collection_name)
+        new_index_name = get_relation_name(self.collection_name, "vector_idx_new")
+
+        with self.cursor(autocommit=True) as cur:
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_index_name};")
+            if not self.can_index():
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+            else:
+                cur.execute(f"SELECT COUNT(*) FROM {self.collection_name};")
+                rows = cur.fetchone()[0]
+                cur.execute(self.vector_index_sql(self.collection_name, new_index_name, rows, concurrently=True))
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name};")
+                cur.execute(f"ALTER INDEX {new_index_name} RENAME TO {index_name};")
+
+        return self.index_status()
+
+    def supports_iterative_scan(self, cur) -> bool:
+        if self.iterative_scan is None:
+            cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector';")
+            row = cur.fetchone()
+            version = tuple(int(part) for part in re.findall(r"\d+", row[0])[:3]) if row else ()
+            self.iterative_scan = version >= iterative_scan_version
+        return self.iterative_scan
+
+    def set_search_params(self, cur, k: int, attributes_filter: dict | None = None):
+        """Per-query recall knobs, SET LOCAL keeps them to this transaction.
+
+        An ann index returns its candidates before the WHERE clause runs, so a filtered search
+        could come back with fewer than k rows. Id filters, and attribute filters on a pgvector
+        without iterative scans, search exactly instead: with index scans off the planner can
+        still reach the matching rows through the primary key and the attributes bitmap index.
+        """
+        if self.index_type not in ["hnsw", "ivfflat"]:
+            return
+
+        exact = bool(self.query_filter)
+        if self.index_type == "hnsw":
+            # hnsw returns at most ef_search rows
+            exact = exact or k > max_hnsw_ef_search
+            cur.execute("SET LOCAL hnsw.ef_search = %s;", (min(max(self.hnsw_ef_search, k), max_hnsw_ef_search),))
+        else:
+            cur.execute("SET LOCAL ivfflat.probes = %s;", (self.ivfflat_probes,))
+
+        if not exact and attributes_filter:
+            if self.supports_iterative_scan(cur):
+                # keep scanning the index until k rows pass the filter, ivfflat only has relaxed_order
+                order = "strict_order" if self.index_type == "hnsw" else "relaxed_order"
+                cur.execute(f"SET LOCAL {self.index_type}.iterative_scan = {order};")
             else:
-                self.insert_raws(batch)
-                batch = []
+                exact = True
+
+        if exact:
+            # a generic plan cached by the prepared statement would keep its index scan
+            cur.execute("SET LOCAL enable_indexscan = off;")
+            cur.execute("SET LOCAL plan_cache_mode = force_custom_plan;")
 
-        if len(batch) > 0:
-            self.insert_raws(batch)
+    def report_load(self, count: int, started_at: float):
+        elapsed = time.time() - started_at
+        self.load_stats = {
+            "rows": count,
+            "elapsed": elapsed,
+            "rows_per_second": count / elapsed if elapsed > 0 else 0,
+        }
+        st.write(f"Loaded {count} rows into `{self.collection_name}` in {elapsed:.2f}s ({self.load_stats['rows_per_second']:.0f} rows/s)")
 
     def filter_by_id(self, include_ids: list[str] | list[int]) -> Any:
-        """Build a query filter to filter documents by id."""
+        """Build a query filter to filter documents by id, applied in SQL by the next searches."""
         if len(include_ids) == 0:
             self.query_filter = None
         else:
-            if isinstance(include_ids[0], str):
-                id_filter = ", ".join([f"'{id}'" for id in include_ids])
-                self.query_filter = f"id in ({id_filter})"
-            else:
-                self.query_filter = (
-                    f"id in ({', '.join([str(id) for id in include_ids])})"
-                )
+            self.query_filter = [str(id) for id in include_ids]
         return self.query_filter
 
-    def similarity_search_by_vector(
-            self, query_embedding: list[float], k: int = 10, **kwargs: Any
-    ) -> list[VectorStoreSearchResult]:
-        """Perform a vector-based similarity search."""
+    def build_search_query(self, include_vector: bool, attributes_filter: dict | None, batch: bool = False):
+        """Search SQL and its extra parameters, k is $2.
+
+        $1 is the query vector, or with `batch` an array of query vectors searched in one
+        round trip with a LATERAL join, rows then start with the query's 1-based position.
+        """
+        conditions = []
+        params = []
+        if self.query_filter:
+            params.append(self.query_filter)
+            conditions.append(f"id = ANY(${len(params) + 2}::varchar[])")
+        if attributes_filter:
+            params.append(json.dumps(attributes_filter))
+            conditions.append(f"attributes @> ${len(params) + 2}::jsonb")
 
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         query = f"""
 SELECT id, 
-       vector, 
+       {'vector::text' if include_vector else 'NULL::text'}, 
        text,
-       attributes,
-       vector <=> '{str(query_embedding)}' AS distance
+       attributes::text,
+       vector <=> {'q.embedding' if batch else '$1'}::{self.vector_type} AS distance
 FROM {self.collection_name}
+{where}
 ORDER BY distance
-LIMIT {k};
+LIMIT $2
         """
-        self.cur.execute(query)
+        if batch:
+            query = f"""
+SELECT q.position, r.*
+FROM unnest($1::text[]) WITH ORDINALITY AS q(embedding, position)
+CROSS JOIN LATERAL ({query}) AS r
+ORDER BY q.position, r.distance
+            """
+        return query, params
 
-        if self.query_filter:
-            st.write(self.query_filter)
+    def similarity_search_by_vector(
+            self, query_embedding: list[float], k: int = 10, **kwargs: Any
+    ) -> list[VectorStoreSearchResult]:
+        """Perform a vector-based similarity search.
 
-        results = self.cur.fetchall()
+        `filter_by_id` ids and an `attributes_filter` dict (JSONB containment) are applied in
+        SQL. Vectors are only returned with `include_vector=True`.
+        """
+        include_vector = kwargs.get("include_vector", False)
+        attributes_filter = kwargs.get("attributes_filter")
+        query, params = self.build_search_query(include_vector, attributes_filter)
 
-        docs = []
-        ids = []
-        for result in results:
-            id = result[0]
-            vector = result[1]
-            text = result[2]
-            attributes = result[3]
-            distance = result[4]
-
-            ids.append({
-                "id": id,
-                "text": text,
-                "distance": distance,
-                "attributes": attributes,
-            })
+        with self.cursor() as cur:
+            self.set_search_params(cur, k, attributes_filter)
+            self.execute_prepared(cur, query, (to_vector_literal(query_embedding), k, *params))
+            results = cur.fetchall()
 
-            docs.append(
-                VectorStoreSearchResult(
-                    document=VectorStoreDocument(
-                        id=id,
-                        text=text,
-                        vector=vector,
-                        attributes=json.loads(attributes),
-                    ),
-                    score=1 - abs(float(distance)),
-                )
-            )
+        # an ivfflat iterative scan may return rows slightly out of order
+        results.sort(key=lambda result: result[4])
+        return [self.to_search_result(result) for result in results]
+
+    def similarity_search_by_vectors(
+            self, query_embeddings: list[list[float]], k: int = 10, **kwargs: Any
+    ) -> list[list[VectorStoreSearchResult]]:
+        """Search many query vectors in one round trip, one result list per query in input order."""
+        if len(query_embeddings) == 0:
+            return []
 
+        include_vector = kwargs.get("include_vector", False)
+        attributes_filter = kwargs.get("attributes_filter")
+        query, params = self.build_search_query(include_vector, attributes_filter, batch=True)
+
+        with self.cursor() as cur:
+            self.set_search_params(cur, k, attributes_filter)
+            self.execute_prepared(cur, query, ([to_vector_literal(embedding) for embedding in query_embeddings], k, *params))
+            results = cur.fetchall()
+
+        docs = [[] for _ in query_embeddings]
+        for result in results:
+            docs[result[0] - 1].append(self.to_search_result(result[1:]))
         return docs
 
+    def to_search_result(self, result: tuple) -> VectorStoreSearchResult:
+        id, vector, text, attributes, distance = result
+        return VectorStoreSearchResult(
+            document=VectorStoreDocument(
+                id=id,
+                text=text,
+                vector=json.loads(vector) if vector else None,
+                attributes=json.loads(attributes),
+            ),
+            score=1 - abs(float(distance)),
+        )
+
     def similarity_search_by_text(
             self, text: str, text_embedder: TextEmbedder, k: int = 10, **kwargs: Any
     ) -> list[VectorStoreSearchResult]:
@@ -210,5 +653,35 @@ LIMIT {k};
         query_embedding = text_embedder(text)
 
         if query_embedding:
-            return self.similarity_search_by_vector(query_embedding, k)
+            return self.similarity_search_by_vector(query_embedding, k, **kwargs)
         return []
+
+    def count_documents(self) -> int:
+        try:
+            with self.cursor() as cur:
+                cur.execute(f"SELECT COUNT(*) FROM {self.collection_name};")
+                return cur.fetchone()[0]
+        except psycopg2.errors.UndefinedTable:
+            return 0
+
+    def delete_documents(self, ids: list[str]) -> None:
+        with self.cursor() as cur:
+            cur.execute(f"DELETE FROM {self.collection_name} WHERE id = ANY(%s::varchar[]);", ([str(id) for id in ids],))
+        debug(f"Deleted {len(ids)} items")
+
+    def search_by_id(self, id: str) -> VectorStoreDocument:
+        """Search for a document by id."""
+        query = f"SELECT id, vector::text, text, attributes::text FROM {self.collection_name} WHERE id = $1"
+        with self.cursor() as cur:
+            self.execute_prepared(cur, query, (id,))
+            result = cur.fetchone()
+
+        if result is None:
+            return VectorStoreDocument(id=id, text=None, vector=None)
+
+        return VectorStoreDocument(
+            id=result[0],
+            text=result[2],
+            vector=json.loads(result[1]) if result[1] else None,
+            attributes=json.loads(result[3]),
+        )
@@ -0,0 +1,440 @@
+import asyncio
+import threading
+from pathlib import Path
+
+import pandas as pd
+import tiktoken
+
+from graphrag.api.query import (
+    _get_embedding_store,
+    _load_search_prompt,
+    _patch_vector_store,
+    _reformat_context_data,
+)
+from graphrag.config.load_config import load_config
+from graphrag.config.resolve_path import resolve_paths
+from graphrag.index.config.embeddings import (
+    community_full_content_embedding,
+    entity_description_embedding,
+)
+from graphrag.query.context_builder.entity_extraction import EntityVectorStoreKey
+from graphrag.query.factory import get_drift_search_engine
+from graphrag.query.indexer_adapters import (
+    read_indexer_communities,
+    read_indexer_covariates,
+    read_indexer_entities,
+    read_indexer_relationships,
+    read_indexer_report_embeddings,
+    read_indexer_reports,
+    read_indexer_text_units,
+)
+from graphrag.query.llm.get_client import get_llm, get_text_embedder
+from graphrag.query.structured_search.global_search.community_context import (
+    GlobalCommunityContext,
+)
+from graphrag.query.structured_search.global_search.search import GlobalSearch
+from graphrag.query.structured_search.local_search.mixed_context import (
+    LocalSearchMixedContext,
+)
+from graphrag.query.structured_search.local_search.search import LocalSearch
+
+import libs.config as config
+from libs.common import debug, project_path
+from libs.npvector import get_np_vector_store
+from libs.vector_search import PrefetchTextEmbedder, PrefetchVectorStore
+from libs.index_manifest import get_index_generation, get_output_signature
+
+NODES_TABLE = "create_final_nodes"
+ENTITIES_TABLE = "create_final_entities"
+COMMUNITIES_TABLE = "create_final_communities"
+COMMUNITY_REPORTS_TABLE = "create_final_community_reports"
+TEXT_UNITS_TABLE = "create_final_text_units"
+RELATIONSHIPS_TABLE = "create_final_relationships"
+COVARIATES_TABLE = "create_final_covariates"
+
+LOCAL_SEARCH = "local"
+GLOBAL_SEARCH = "global"
+DRIFT_SEARCH = "drift"
+
+project_engines = {}
+project_engines_lock = threading.Lock()
+
+
+class ProjectEngine:
+    """Index tables, context builders and embedding stores of one project, loaded once."""
+
+    def __init__(self, project_name: str, signature: tuple):
+        self.project_name = project_name
+        self.signature = signature
+        self.generation = get_index_generation(project_name)
+        self.lock = threading.Lock()
+
+        root = project_path(project_name).resolve()
+        self.config = load_config(root, None)
+        resolve_paths(self.config)
+
+        output_dir = Path(self.config.storage.base_dir)
+        self.nodes = pd.read_parquet(output_dir / f"{NODES_TABLE}.parquet")
+        self.entities = pd.read_parquet(output_dir / f"{ENTITIES_TABLE}.parquet")
+        self.communities = pd.read_parquet(output_dir / f"{COMMUNITIES_TABLE}.parquet")
+        self.community_reports = pd.read_parquet(output_dir / f"{COMMUNITY_REPORTS_TABLE}.parquet")
+        self.text_units = pd.read_parquet(output_dir / f"{TEXT_UNITS_TABLE}.parquet")
+        self.relationships = pd.read_parquet(output_dir / f"{RELATIONSHIPS_TABLE}.parquet")
+
+        covariates_file = output_dir / f"{COVARIATES_TABLE}.parquet"
+        self.covariates = pd.read_parquet(covariates_file) if covariates_file.exists() else None
+
+        self.token_encoder = tiktoken.get_encoding(self.config.encoding_model)
+        self.text_embedder = PrefetchTextEmbedder(get_text_embedder(self.config))
+
+        self.local_prompt = _load_search_prompt(self.config.root_dir, self.config.local_search.prompt)
+        self.drift_prompt = _load_search_prompt(self.config.root_dir, self.config.drift_search.prompt)
+        self.map_prompt = _load_search_prompt(self.config.root_dir, self.config.global_search.map_prompt)
+        self.reduce_prompt = _load_search_prompt(self.config.root_dir, self.config.global_search.reduce_prompt)
+        self.knowledge_prompt = _load_search_prompt(self.config.root_dir, self.config.global_search.knowledge_prompt)
+
+        self.description_embedding_store = None
+        self.full_content_embedding_store = None
+
+        # everything below depends on the community level and is built on first use
+        self.levels = {}
+
+    def get_embedding_stores(self, community_level: int):
+        if self.description_embedding_store is not None:
+            return
+
+        # the lancedb store is local and tied to the project folder, so it is
+        # loaded from the index output once instead of on every query
+        _patch_vector_store(
+            self.config,
+            self.nodes,
+            self.entities,
+            community_level,
+            with_reports=self.community_reports,
+        )
+
+        vector_store_args = self.config.embeddings.vector_store
+        if vector_store_args.get("type") == "lancedb":
+            vector_store_args["db_uri"] = str(Path(self.config.root_dir).resolve() / vector_store_args["db_uri"])
+
+        description_embedding_store = None
+        if config.query_vector_store == "numpy":
+            # entity search in process, no round trip to a vector database per query
+            description_embedding_store = get_np_vector_store(self.project_name)
+            if description_embedding_store.count_documents() == 0:
+                debug(f"No Local NumPy embeddings for {self.project_name}, using the settings.yaml vector store")
+                description_embedding_store = None
+        if description_embedding_store is None:
+            description_embedding_store = _get_embedding_store(
+                config_args=vector_store_args,
+                embedding_name=entity_description_embedding,
+            )
+        self.description_embedding_store = PrefetchVectorStore(description_embedding_store)
+        self.full_content_embedding_store = _get_embedding_store(
+            config_args=vector_store_args,
+            embedding_name=community_full_content_embedding,
+        )
+
+    def get_level(self, community_level: int):
+        with self.lock:
+            if community_level in self.levels:
+                return self.levels[community_level]
+
+            self.get_embedding_stores(community_level)
+
+            entities = read_indexer_entities(self.nodes, self.entities, community_level)
+            reports = read_indexer_reports(self.community_reports, self.nodes, community_level)
+            text_units = read_indexer_text_units(self.text_units)
+            relationships = read_indexer_relationships(self.relationships)
+            covariates = read_indexer_covariates(self.covariates) if self.covariates is not None else []
+
+            communities = read_indexer_communities(self.communities, self.nodes, self.community_reports)
+
+            level = {
+                "entities": entities,
+                "reports": reports,
+                "text_units": text_units,
+                "relationships": relationships,
+                "communities": communities,
+                "report_embeddings": False,
+                "local_context": LocalSearchMixedContext(
+                    community_reports=reports,
+                    text_units=text_units,
+                    entities=entities,
+                    relationships=relationships,
+                    covariates={"claims": covariates},
+                    entity_text_embeddings=self.description_embedding_store,
+                    embedding_vectorstore_key=EntityVectorStoreKey.ID,
+                    text_embedder=self.text_embedder,
+                    token_encoder=self.token_encoder,
+                ),
+                "global_context": GlobalCommunityContext(
+                    community_reports=reports,
+                    communities=communities,
+                    entities=entities,
+                    token_encoder=self.token_encoder,
+                ),
+            }
+            self.levels[community_level] = level
+            return level
+
+    async def aget_level(self, community_level: int):
+        # the first query of a level converts the tables to graphrag objects
+        if community_level in self.levels:
+            return self.levels[community_level]
+        return await asyncio.to_thread(self.get_level, community_level)
+
+    def get_local_search(self, community_level: int, response_type: str):
+        level = self.get_level(community_level)
+        ls_config = self.config.local_search
+
+        return LocalSearch(
+            llm=get_llm(self.config),
+            system_prompt=self.local_prompt,
+            context_builder=level["local_context"],
+            token_encoder=self.token_encoder,
+            llm_params={
+                "max_tokens": ls_config.llm_max_tokens,
+                "temperature": ls_config.temperature,
+                "top_p": ls_config.top_p,
+                "n": ls_config.n,
+            },
+            context_builder_params={
+                "text_unit_prop": ls_config.text_unit_prop,
+                "community_prop": ls_config.community_prop,
+                "conversation_history_max_turns": ls_config.conversation_history_max_turns,
+                "conversation_history_user_turns_only": True,
+                "top_k_mapped_entities": ls_config.top_k_entities,
+                "top_k_relationships": ls_config.top_k_relationships,
+                "include_entity_rank": True,
+                "include_relationship_weight": True,
+                "include_community_rank": False,
+                "return_candidate_context": False,
+                "embedding_vectorstore_key": EntityVectorStoreKey.ID,
+                "max_tokens": ls_config.max_tokens,
+            },
+            response_type=response_type,
+        )
+
+    def get_global_search(self, community_level: int, response_type: str, dynamic_community_selection: bool):
+        level = self.get_level(community_level)
+        gs_config = self.config.global_search
+        llm = get_llm(self.config)
+
+        if dynamic_community_selection:
+            # dynamic selection scores reports with the llm, so its context is not shared
+            context_builder = GlobalCommunityContext(
+                community_reports=read_indexer_reports(
+                    self.community_reports,
+                    self.nodes,
+                    community_level=community_level,
+                    dynamic_community_selection=True,
+                ),
+                communities=level["communities"],
+                entities=level["entities"],
+                token_encoder=self.token_encoder,
+                dynamic_community_selection=True,
+                dynamic_community_selection_kwargs={
+                    "llm": llm,
+                    "token_encoder": tiktoken.encoding_for_model(self.config.llm.model),
+                    "keep_parent": gs_config.dynamic_search_keep_parent,
+                    "num_repeats": gs_config.dynamic_search_num_repeats,
+                    "use_summary": gs_config.dynamic_search_use_summary,
+                    "concurrent_coroutines": gs_config.dynamic_search_concurrent_coroutines,
+                    "threshold": gs_config.dynamic_search_threshold,
+                    "max_level": gs_config.dynamic_search_max_level,
+                },
+            )
+        else:
+            context_builder = level["global_context"]
+
+        return GlobalSearch(
+            llm=llm,
+            map_system_prompt=self.map_prompt,
+            reduce_system_prompt=self.reduce_prompt,
+            general_knowledge_inclusion_prompt=self.knowledge_prompt,
+            context_builder=context_builder,
+            token_encoder=self.token_encoder,
+            max_data_tokens=gs_config.data_max_tokens,
+            map_llm_params={
+                "max_tokens": gs_config.map_max_tokens,
+                "temperature": gs_config.temperature,
+                "top_p": gs_config.top_p,
+                "n": gs_config.n,
+            },
+            reduce_llm_params={
+                "max_tokens": gs_config.reduce_max_tokens,
+                "temperature": gs_config.temperature,
+                "top_p": gs_config.top_p,
+                "n": gs_config.n,
+            },
+            allow_general_knowledge=False,
+            json_mode=False,
+            context_builder_params={
+                "use_community_summary": False,
+                "shuffle_data": True,
+                "include_community_rank": True,
+                "min_community_rank": 0,
+                "community_rank_name": "rank",
+                "include_community_weight": True,
+                "community_weight_name": "occurrence weight",
+                "normalize_community_weight": True,
+                "max_tokens": gs_config.max_tokens,
+                "context_name": "Reports",
+            },
+            concurrent_coroutines=gs_config.concurrency,
+            response_type=response_type,
+        )
+
+    def get_drift_search(self, community_level: int):
+        level = self.get_level(community_level)
+
+        with self.lock:
+            if not level["report_embeddings"]:
+                read_indexer_report_embeddings(level["reports"], self.full_content_embedding_store)
+                level["report_embeddings"] = True
+
+        # drift search keeps its query state on the engine, so it is built per query
+        return get_drift_search_engine(
+            config=self.config,
+            reports=level["reports"],
+            text_units=level["text_units"],
+            entities=level["entities"],
+            relationships=level["relationships"],
+            description_embedding_store=self.description_embedding_store,
+            local_system_prompt=self.drift_prompt,
+        )
+
+    async def build_local_context(self, search_engine: LocalSearch, query: str):
+        # building local context embeds the query with a blocking client and
+        # ranks the tables in python, keep it off the event loop
+        context_result = await asyncio.to_thread(
+            search_engine.context_builder.build_context,
+            query=query,
+            conversation_history=None,
+            **search_engine.context_builder_params,
+        )
+        search_prompt = search_engine.system_prompt.format(
+            context_data=context_result.context_chunks,
+            response_type=search_engine.response_type,
+        )
+        search_messages = [
+            {"role": "system", "content": search_prompt},
+            {"role": "user", "content": query},
+        ]
+        return context_result, search_messages
+
+    async def local_search(self, query: str, community_level: int, response_type: str):
+        await self.aget_level(community_level)
+        search_engine = self.get_local_search(community_level, response_type)
+        context_result, search_messages = await self.build_local_context(search_engine, query)
+
+        response = await search_engine.llm.agenerate(
+            messages=search_messages,
+            streaming=True,
+            callbacks=search_engine.callbacks,
+            **search_engine.llm_params,
+        )
+        return response, _reformat_context_data(context_result.context_records)
+
+    def prefetch_query_embeddings(self, search_type: str, queries: list[str], community_level: int):
+        """Embed a batch of local search queries in a few requests and search their entities at once.
+
+        The queries are then searched one by one, their embeddings and entity matches come from memory.
+        """
+        if search_type == LOCAL_SEARCH and len(queries) > 1:
+            self.get_level(community_level)
+            self.text_embedder.prefetch(queries)
+            # map_query_to_entities oversamples top_k_entities by 2
+            self.description_embedding_store.prefetch(queries, self.text_embedder, self.config.local_search.top_k_entities * 2)
+
+    def clear_prefetched(self):
+        """Drop the entity searches a batch prefetched but did not use."""
+        if self.description_embedding_store is not None:
+            self.description_embedding_store.clear()
+
+    async def search(self, search_type: str, query: str, community_level: int, response_type: str, dynamic_community_selection: bool = False):
+        if search_type == LOCAL_SEARCH:
+            return await self.local_search(query, community_level, response_type)
+        if search_type == GLOBAL_SEARCH:
+            return await self.global_search(query, community_level, response_type, dynamic_community_selection)
+        if search_type == DRIFT_SEARCH:
+            return await self.drift_search(query, community_level)
+
+        raise Exception(f"Unknown search type {search_type}")
+
+    async def local_search_streaming(self, query: str, community_level: int, response_type: str):
+        """Yield the context data first, then the response tokens as they arrive."""
+        await self.aget_level(community_level)
+        search_engine = self.get_local_search(community_level, response_type)
+        context_result, search_messages = await self.build_local_context(search_engine, query)
+
+        yield _reformat_context_data(context_result.context_records)
+        async for token in search_engine.llm.astream_generate(
+            messages=search_messages,
+            callbacks=search_engine.callbacks,
+            **search_engine.llm_params,
+        ):
+            yield token
+
+    async def global_search_streaming(self, query: str, community_level: int, response_type: str, dynamic_community_selection: bool = False):
+        """Yield the context data once the map step is done, then the reduce response tokens."""
+        await self.aget_level(community_level)
+        search_engine = self.get_global_search(community_level, response_type, dynamic_community_selection)
+
+        get_context_data = True
+        async for stream_chunk in search_engine.astream_search(query=query):
+            if get_context_data:
+                yield _reformat_context_data(stream_chunk)
+                get_context_data = False
+            else:
+                yield stream_chunk
+
+    async def global_search(self, query: str, community_level: int, response_type: str, dynamic_community_selection: bool = False):
+        await self.aget_level(community_level)
+        search_engine = self.get_global_search(community_level, response_type, dynamic_community_selection)
+        result = await search_engine.asearch(query=query)
+        return result.response, _reformat_context_data(result.context_data)
+
+    async def drift_search(self, query: str, community_level: int):
+        await self.aget_level(community_level)
+        search_engine = await asyncio.to_thread(self.get_drift_search, community_level)
+        result = await search_engine.asearch(query=query)
+        context_data = _reformat_context_data(result.context_data)
+
+        # same as graphrag.api.drift_search: return the highest scoring answer
+        response = result.response
+        if isinstance(response, dict):
+            return response["nodes"][0]["answer"], context_data
+        return response, context_data
+
+    async def drift_search_streaming(self, query: str, community_level: int):
+        """graphrag can not stream drift search yet, the answer is sent as one chunk after the context."""
+        response, context_data = await self.drift_search(query, community_level)
+        yield context_data
+        yield response
+
+
+def get_project_engine(project_name: str):
+    signature = get_output_signature(project_name)
+
+    with project_engines_lock:
+        engine = project_engines.get(project_name)
+        if engine is not None and engine.signature == signature:
+            return engine
+
+    # build outside the registry lock so other projects keep serving
+    engine = ProjectEngine(project_name, signature)
+
+    with project_engines_lock:
+        current = project_engines.get(project_name)
+        if current is not None and current.signature == signature:
+            return current
+        project_engines[project_name] = engine
+
+    return engine
+
+
+async def aget_project_engine(project_name: str):
+    # loading parquet files is blocking, the api awaits it from a worker thread
+    return await asyncio.to_thread(get_project_engine, project_name)
@@ -6,7 +6,24 @@ from openpyxl.utils import get_column_letter
 from io import BytesIO
 
 
-def render_excel_file(uploaded_file): 
+def render_score_summary(wb, score_summary: dict, header_fill, border):
+    """Score stats sheet placed first: one row per sheet with mean, range and score distribution."""
+    summary = wb.create_sheet("Score Summary", 0)
+
+    headers = ["sheet"] + list(next(iter(score_summary.values())).keys())
+    for c, header_text in enumerate(headers, start=1):
+        cell = summary.cell(row=1, column=c, value=header_text)
+        cell.fill = header_fill
+        cell.border = border
+        summary.column_dimensions[get_column_letter(c)].width = 15
+
+    for r, (sheet_name, stats) in enumerate(score_summary.items(), start=2):
+        values = [sheet_name] + [stats[header] for header in headers[1:]]
+        for c, value in enumerate(values, start=1):
+            summary.cell(row=r, column=c, value=value).border = border
+
+
+def render_excel_file(uploaded_file, score_summary: dict = None): 
     wb = load_workbook(uploaded_file)
 
     header_fill = PatternFill(start_color="00B050", end_color="00B050", fill_type="solid")
@@ -54,6 +71,9 @@ def render_excel_file(uploaded_file):
         for r in range(2, max_row + 1):
             sheet.cell(row=r, column=max_col - 2, value="-")
 
+    if score_summary:
+        render_score_summary(wb, score_summary, header_fill, border)
+
     output = BytesIO()
     wb.save(output)
     output.seek(0)
@@ -0,0 +1,214 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import libs.config as config
+from libs.common import generate_text_fingerprint
+
+
+def normalize_query(query: str):
+    return " ".join(query.split()).casefold()
+
+
+def make_cache_key(project_name: str, search_type: str, query: str, community_level: int, index_version: str, **params):
+    key = {
+        "project_name": project_name,
+        "search_type": search_type,
+        "query": normalize_query(query),
+        "community_level": int(community_level),
+        "index_version": index_version,
+        **params,
+    }
+    return generate_text_fingerprint(json.dumps(key, sort_keys=True, ensure_ascii=False))
+
+
+class ResultCache:
+    """LRU result cache with a TTL and byte budget, optionally backed by SQLite so workers share hits."""
+
+    def __init__(self, ttl: float, max_bytes: int, db_path: str = ""):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0, "purged": 0}
+        self.project_versions = {}
+
+        if self.db_path:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            with self.connect() as conn:
+                conn.execute("""
+CREATE TABLE IF NOT EXISTS result_cache (
+    key TEXT PRIMARY KEY,
+    project_name TEXT,
+    index_version TEXT,
+    value TEXT,
+    size INTEGER,
+    expires_at REAL,
+    accessed_at REAL
+);
+""")
+                conn.execute("CREATE INDEX IF NOT EXISTS result_cache_accessed_at ON result_cache (accessed_at);")
+                conn.execute("CREATE INDEX IF NOT EXISTS result_cache_project_name ON result_cache (project_name, index_version);")
+
+    @contextmanager
+    def connect(self):
+        # one short-lived connection per call, sqlite serializes the workers for us
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str):
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, size, value, project_name, index_version = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                self.pop_entry(key)
+                self.counters["expired"] += 1
+
+        if self.db_path:
+            with self.connect() as conn:
+                row = conn.execute("SELECT value, expires_at, project_name, index_version FROM result_cache WHERE key = ?;", (key,)).fetchone()
+                if row and row[1] > now:
+                    conn.execute("UPDATE result_cache SET accessed_at = ? WHERE key = ?;", (now, key))
+                    value = json.loads(row[0])
+                    with self.lock:
+                        self.counters["disk_hits"] += 1
+                        self.put_entry(key, value, len(row[0]), row[1], row[2], row[3])
+                    return value
+                if row:
+                    conn.execute("DELETE FROM result_cache WHERE key = ?;", (key,))
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def set(self, key: str, value: dict, project_name: str = "", index_version: str = ""):
+        data = json.dumps(value, ensure_ascii=False, default=str)
+        size = len(data)
+        expires_at = time.time() + self.ttl
+
+        # a single result larger than the whole budget is not worth caching
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            self.put_entry(key, value, size, expires_at, project_name, index_version)
+
+        if self.db_path:
+            with self.connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO result_cache (key, project_name, index_version, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?);",
+                    (key, project_name, index_version, data, size, expires_at, time.time()),
+                )
+                self.evict_disk(conn)
+
+    def put_entry(self, key: str, value: dict, size: int, expires_at: float, project_name: str, index_version: str):
+        if key in self.entries:
+            self.pop_entry(key)
+        self.entries[key] = (expires_at, size, value, project_name, index_version)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes and self.entries:
+            oldest_key = next(iter(self.entries))
+            self.pop_entry(oldest_key)
+            self.counters["evictions"] += 1
+
+    def pop_entry(self, key: str):
+        entry = self.entries.pop(key)
+        self.bytes -= entry[1]
+
+    def evict_disk(self, conn: sqlite3.Connection):
+        deleted = conn.execute("DELETE FROM result_cache WHERE expires_at <= ?;", (time.time(),)).rowcount
+        with self.lock:
+            self.counters["expired"] += deleted
+
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache;").fetchone()
+        if total <= self.max_bytes:
+            return
+
+        overflow = total - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in conn.execute("SELECT key, size FROM result_cache ORDER BY accessed_at;"):
+            keys.append((key,))
+            freed += size
+            if freed >= overflow:
+                break
+        conn.executemany("DELETE FROM result_cache WHERE key = ?;", keys)
+        with self.lock:
+            self.counters["evictions"] += len(keys)
+
+    def purge_stale(self, project_name: str, index_version: str):
+        """Drop every entry of the project that was computed from another index generation."""
+        with self.lock:
+            if self.project_versions.get(project_name) == index_version:
+                return
+            self.project_versions[project_name] = index_version
+
+            stale_keys = [
+                key for key, entry in self.entries.items()
+                if entry[3] == project_name and entry[4] != index_version
+            ]
+            for key in stale_keys:
+                self.pop_entry(key)
+            self.counters["purged"] += len(stale_keys)
+
+        if self.db_path:
+            with self.connect() as conn:
+                deleted = conn.execute(
+                    "DELETE FROM result_cache WHERE project_name = ? AND index_version != ?;",
+                    (project_name, index_version),
+                ).rowcount
+            with self.lock:
+                self.counters["purged"] += deleted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            self.project_versions.clear()
+        if self.db_path:
+            with self.connect() as conn:
+                conn.execute("DELETE FROM result_cache;")
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                **self.counters,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+            }
+
+        if self.db_path:
+            with self.connect() as conn:
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM result_cache;").fetchone()
+                stats["disk_entries"] = entries
+                stats["disk_bytes"] = size
+
+        return stats
+
+
+result_cache = ResultCache(
+    ttl=config.result_cache_ttl,
+    max_bytes=config.result_cache_max_bytes,
+    db_path=config.result_cache_db,
+)
@@ -0,0 +1,172 @@
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+
+from libs.common import generate_text_fingerprint
+
+SOURCE_INDEX_FILE = "source_index.db"
+SOURCE_INDEX_VERSION = 1
+
+
+def get_pdf_cache_dir(project_name: str):
+    return f"/app/projects/{project_name}/pdf_cache"
+
+
+def parse_page_file(txt_file: str):
+    """(pdf file, screenshot file, page number) of a page text file, None for other files."""
+    match = re.match(r"(.*?\.pdf)_page_(\d+)\.png\..*txt$", txt_file)
+    if not match:
+        return None
+    pdf_file = match.group(1)
+    page_number = int(match.group(2))
+    return pdf_file, f"{pdf_file}_page_{page_number}.png", page_number
+
+
+def get_line_hashes(text: str):
+    """Hashes of the distinct non-empty lines of a text, the keys of the page line index."""
+    lines = {line.strip() for line in text.split("\n")}
+    return [generate_text_fingerprint(line)[:16] for line in lines if line]
+
+
+def get_anchor_line(text: str):
+    """The longest line of `text` that is whole wherever `text` occurs, None when it has none.
+
+    A text unit can start and end mid-line, only the lines between its first and last
+    newline are sure to be whole lines of the page that contains it.
+    """
+    lines = [line.strip() for line in text.split("\n")[1:-1]]
+    return max(lines, key=len) if any(lines) else None
+
+
+def index_page_lines(conn: sqlite3.Connection, txt_file: str, text: str):
+    conn.execute("DELETE FROM page_lines WHERE txt_file = ?;", (txt_file,))
+    conn.executemany(
+        "INSERT INTO page_lines (line_hash, txt_file) VALUES (?, ?);",
+        [(line_hash, txt_file) for line_hash in get_line_hashes(text)],
+    )
+
+
+@contextmanager
+def connect(project_name: str):
+    base_dir = get_pdf_cache_dir(project_name)
+    os.makedirs(base_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(base_dir, SOURCE_INDEX_FILE), timeout=10)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        with conn:
+            conn.execute("""
+CREATE TABLE IF NOT EXISTS pages (
+    txt_file TEXT PRIMARY KEY,
+    pdf_file TEXT,
+    screenshot_file TEXT,
+    page_number INTEGER,
+    mtime_ns INTEGER,
+    text TEXT
+);
+""")
+            # line hash -> pages holding that line, narrows a lookup to a few candidate pages
+            conn.execute("""
+CREATE TABLE IF NOT EXISTS page_lines (
+    line_hash TEXT,
+    txt_file TEXT
+);
+""")
+            conn.execute("CREATE INDEX IF NOT EXISTS page_lines_line_hash ON page_lines (line_hash);")
+            conn.execute("CREATE INDEX IF NOT EXISTS page_lines_txt_file ON page_lines (txt_file);")
+            (version,) = conn.execute("PRAGMA user_version;").fetchone()
+            if version < SOURCE_INDEX_VERSION:
+                # indexes from before the line index remembered lookups in `sources`
+                conn.execute("DROP TABLE IF EXISTS sources;")
+                for txt_file, text in conn.execute("SELECT txt_file, text FROM pages;").fetchall():
+                    index_page_lines(conn, txt_file, text)
+                conn.execute(f"PRAGMA user_version = {SOURCE_INDEX_VERSION};")
+            yield conn
+    finally:
+        conn.close()
+
+
+def index_page(project_name: str, txt_path: str, text: str, conn: sqlite3.Connection = None):
+    """Add or refresh one page text file, called as pdf_txt writes (or reuses) it."""
+    txt_file = os.path.basename(txt_path)
+    file_info = parse_page_file(txt_file)
+    if file_info is None:
+        return
+    pdf_file, screenshot_file, page_number = file_info
+    mtime_ns = os.stat(txt_path).st_mtime_ns if os.path.exists(txt_path) else 0
+
+    if conn is None:
+        with connect(project_name) as conn:
+            return index_page(project_name, txt_path, text, conn)
+
+    row = conn.execute("SELECT text FROM pages WHERE txt_file = ?;", (txt_file,)).fetchone()
+    if row and row[0] == text:
+        conn.execute("UPDATE pages SET mtime_ns = ? WHERE txt_file = ?;", (mtime_ns, txt_file))
+        return
+
+    conn.execute(
+        "INSERT OR REPLACE INTO pages (txt_file, pdf_file, screenshot_file, page_number, mtime_ns, text) VALUES (?, ?, ?, ?, ?, ?);",
+        (txt_file, pdf_file, screenshot_file, page_number, mtime_ns, text),
+    )
+    index_page_lines(conn, txt_file, text)
+
+
+def remove_pdf_pages(project_name: str, pdf_file: str):
+    """Forget every page of `pdf_file`, when its page files are removed."""
+    with connect(project_name) as conn:
+        conn.execute("DELETE FROM page_lines WHERE txt_file IN (SELECT txt_file FROM pages WHERE pdf_file = ?);", (pdf_file,))
+        removed = conn.execute("DELETE FROM pages WHERE pdf_file = ?;", (pdf_file,)).rowcount
+    return removed
+
+
+def sync_source_index(project_name: str):
+    """Index page files written before the index existed, or changed on disk since."""
+    base_dir = get_pdf_cache_dir(project_name)
+    if not os.path.exists(base_dir):
+        return 0
+
+    updated = 0
+    with connect(project_name) as conn:
+        indexed = dict(conn.execute("SELECT txt_file, mtime_ns FROM pages;").fetchall())
+        for entry in os.scandir(base_dir):
+            if not entry.is_file() or parse_page_file(entry.name) is None:
+                continue
+            if indexed.get(entry.name) == entry.stat().st_mtime_ns:
+                continue
+            with open(entry.path, 'r', encoding='utf-8', errors='ignore') as f:
+                index_page(project_name, entry.path, f.read(), conn)
+            updated += 1
+    return updated
+
+
+def find_source_pages(project_name: str, texts: list[str]):
+    """Pages containing each text, as {text: [(pdf file, screenshot file, page number), ...]}.
+
+    Only pages sharing the text's anchor line are searched. Texts without a whole line of
+    their own (shorter than a line) fall back to searching every page.
+    """
+    results = {}
+    with connect(project_name) as conn:
+        for text in texts:
+            if text in results:
+                continue
+            anchor_line = get_anchor_line(text)
+            if anchor_line is not None:
+                pages = conn.execute("""
+SELECT pdf_file, screenshot_file, page_number FROM pages
+WHERE txt_file IN (SELECT txt_file FROM page_lines WHERE line_hash = ?) AND instr(text, ?) > 0
+ORDER BY pdf_file, page_number;
+""", (generate_text_fingerprint(anchor_line)[:16], text)).fetchall()
+            else:
+                pages = conn.execute(
+                    "SELECT pdf_file, screenshot_file, page_number FROM pages WHERE instr(text, ?) > 0 ORDER BY pdf_file, page_number;",
+                    (text,),
+                ).fetchall()
+            results[text] = [(pdf_file, screenshot_file, int(page_number)) for pdf_file, screenshot_file, page_number in pages]
+    return results
+
+
+def has_source_index(project_name: str):
+    with connect(project_name) as conn:
+        (count,) = conn.execute("SELECT COUNT(*) FROM pages;").fetchone()
+    return count > 0
@@ -1,31 +1,56 @@
 
-import pandas as pd
 import streamlit as st
 import os
 
 from graphrag.query.indexer_adapters import (
     read_indexer_entities,
 )
-from graphrag.query.input.loaders.dfs import store_entity_semantic_embeddings
+from graphrag.vector_stores.base import VectorStoreDocument
 from libs.pgvector import PgVectorStore
+from libs.npvector import get_np_vector_store
 from theodoretools.fs import list_subdirectories
 import libs.config as config
 from graphrag.vector_stores.lancedb import LanceDBVectorStore
 from libs.azure_ai_search import AzureAISearch
+from libs.vector_sync import get_sync_manifest_file, sync_documents
+from libs.artifacts import read_artifact, read_embeddings
 
 PG = 'PostgreSQL Vector'
 MILVUS = 'milvus'
 LANCE = 'lance'
 AI_SEARCH = 'Azure AI Search'
+NUMPY = 'Local NumPy'
 
 
 def store_vector(project_name: str):
 
+    full_reload = st.checkbox("Full reload (otherwise only changed entities are written)", value=False, key=f"store_vector_full_{project_name}")
+
     if not config.disable_aisearch and st.button(f'Store data on {AI_SEARCH}', key=f"store_vector_aisearch_{project_name}"):
-            store_vector_pgvector(project_name=project_name, db=AI_SEARCH)
+            store_vector_pgvector(project_name=project_name, db=AI_SEARCH, full=full_reload)
 
     if not config.disable_pgvector and st.button(f'Store data on {PG}', key=f"store_vector_pg_{project_name}"):
-            store_vector_pgvector(project_name=project_name, db=PG)
+            store_vector_pgvector(project_name=project_name, db=PG, full=full_reload)
+
+    if st.button(f'Store data on {NUMPY}', key=f"store_vector_numpy_{project_name}"):
+            store_vector_pgvector(project_name=project_name, db=NUMPY, full=full_reload)
+
+    if not config.disable_pgvector:
+        c1, c2, c3 = st.columns([1, 1, 1])
+        with c1:
+            if st.button(f'{PG} index status', key=f"pg_index_status_{project_name}"):
+                st.write(get_pg_vector_store(project_name).index_status())
+        with c2:
+            if st.button(f'Rebuild {PG} index', key=f"pg_index_rebuild_{project_name}"):
+                with st.spinner('Rebuilding index ...'):
+                    st.write(get_pg_vector_store(project_name).rebuild_index())
+        with c3:
+            if st.button(f'Migrate {PG} table', key=f"pg_migrate_{project_name}"):
+                try:
+                    changes = get_pg_vector_store(project_name).migrate_table()
+                    st.success(f"Migrated: {changes}" if changes else "Table is up to date")
+                except Exception as e:
+                    st.error(e)
             
     # if st.button('Store LanceDB', key=f"store_vector_lance_{project_name}"):
     #         store_vector_pgvector(project_name=project_name, db=LANCE)
@@ -33,7 +58,7 @@ def store_vector(project_name: str):
     #         store_vector_pgvector(project_name=project_name, db=MILVUS)
 
 
-def store_vector_pgvector(project_name: str, db: str=PG):
+def store_vector_pgvector(project_name: str, db: str=PG, full: bool=False):
     base_path = f"/app/projects/{project_name}"
     
     subdirectories = list_subdirectories(path=f"{base_path}/output")
@@ -49,23 +74,41 @@ def store_vector_pgvector(project_name: str, db: str=PG):
     
     with st.spinner(f'Processing ...'):
         community_level = 2
-        input_dir = f"{base_path}/output"
-        entity_df = pd.read_parquet(f"{input_dir}/create_final_nodes.parquet")
-        entity_embedding_df = pd.read_parquet(f"{input_dir}/create_final_entities.parquet")
+        entity_df = read_artifact(project_name, "create_final_nodes", ["id", "degree", "community", "level"])
+        # embeddings stay in one float32 matrix instead of going through pandas as per-row lists
+        entity_embedding_df = read_artifact(project_name, "create_final_entities", ["id", "title", "name", "type", "human_readable_id", "description", "text_unit_ids"])
         entities = read_indexer_entities(entity_df, entity_embedding_df, community_level)
+        embedding_ids, embeddings = read_embeddings(project_name, "create_final_entities", "description_embedding")
+        embedding_rows = {str(id): row for row, id in enumerate(embedding_ids)}
 
         embedding_store = get_embedding_store(db=db, project_name=project_name)
 
-        if db == PG:
-            embedding_store.truncate_table()
-            st.write(f"Your table is truncated")
-
         st.write(f"Starting to store embeddings ...")
-        store_entity_semantic_embeddings(
-            entities=entities,
-            vectorstore=embedding_store
+        documents = [
+            VectorStoreDocument(
+                id=entity.id,
+                text=entity.description,
+                vector=embeddings[embedding_rows[entity.id]],
+                attributes=(
+                    {"title": entity.title, **entity.attributes}
+                    if entity.attributes
+                    else {"title": entity.title}
+                ),
+            )
+            for entity in entities
+            if entity.id in embedding_rows
+        ]
+        stats = sync_documents(
+            store=embedding_store,
+            documents=documents,
+            manifest_file=get_sync_manifest_file(project_name, db),
+            full=full,
         )
-        st.success(f"Semantic embeddings stored") 
+        st.write(stats)
+        if not stats["synced"]:
+            st.warning(f"{db} holds {stats['stored']} embeddings, the next store will reload everything.")
+        else:
+            st.success(f"Semantic embeddings stored") 
 
 
 def get_embedding_store(db:str, project_name:str):
@@ -77,6 +120,8 @@ def get_embedding_store(db:str, project_name:str):
         return get_lancedb_store(project_name)
     if db == AI_SEARCH:
         return get_ai_search_store(project_name)
+    if db == NUMPY:
+        return get_np_vector_store(project_name)
     
     raise Exception(f"Unknown db {db}")
 
@@ -0,0 +1,151 @@
+import concurrent.futures
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import libs.config as config
+
+
+def embed_texts(text_embedder: Any, texts: list[str], batch_size: int = None) -> list[list[float]]:
+    """Embeddings of many texts, one request per batch when the embedder exposes its OpenAI client.
+
+    Texts longer than the embedder's token limit go through `embed`, which chunks and averages them.
+    """
+    batch_size = batch_size or config.embedding_batch_size
+    client = getattr(text_embedder, "sync_client", None)
+    if client is None:
+        embed = text_embedder.embed if hasattr(text_embedder, "embed") else text_embedder
+        return [embed(text) for text in texts]
+
+    token_encoder = getattr(text_embedder, "token_encoder", None)
+    max_tokens = getattr(text_embedder, "max_tokens", None)
+
+    embeddings = [None] * len(texts)
+    batch_indexes = []
+    for index, text in enumerate(texts):
+        if token_encoder is not None and max_tokens and len(token_encoder.encode(text)) > max_tokens:
+            embeddings[index] = text_embedder.embed(text)
+        else:
+            batch_indexes.append(index)
+
+    for start in range(0, len(batch_indexes), batch_size):
+        indexes = batch_indexes[start:start + batch_size]
+        response = client.embeddings.create(input=[texts[index] for index in indexes], model=text_embedder.model)
+        for item in response.data:
+            embeddings[indexes[item.index]] = item.embedding
+
+    return embeddings
+
+
+def similarity_search_by_vectors(store: Any, query_embeddings: list[list[float]], k: int = 10, **kwargs: Any):
+    """One result list per query vector, in input order.
+
+    Stores with a native `similarity_search_by_vectors` (pgvector) answer in one round trip,
+    the others (LanceDB, Azure AI Search) run their single-vector search on a thread pool.
+    """
+    if hasattr(store, "similarity_search_by_vectors"):
+        return store.similarity_search_by_vectors(query_embeddings, k, **kwargs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config.vector_search_parallelism) as executor:
+        return list(executor.map(lambda embedding: store.similarity_search_by_vector(embedding, k, **kwargs), query_embeddings))
+
+
+class PrefetchTextEmbedder:
+    """Wraps a text embedder so a batch of queries can be embedded up front in a few requests.
+
+    graphrag's context builders embed one query at a time through `embed`, prefetched
+    queries are served from memory and everything else goes to the wrapped embedder.
+    """
+
+    def __init__(self, text_embedder: Any, max_entries: int = 4096):
+        self.text_embedder = text_embedder
+        self.max_entries = max_entries
+        self.embeddings = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.text_embedder, name)
+
+    def prefetch(self, texts: list[str]):
+        with self.lock:
+            pending = [text for text in dict.fromkeys(texts) if text not in self.embeddings]
+        if len(pending) == 0:
+            return
+
+        embeddings = embed_texts(self.text_embedder, pending)
+        with self.lock:
+            for text, embedding in zip(pending, embeddings):
+                if embedding:
+                    self.embeddings[text] = embedding
+            while len(self.embeddings) > self.max_entries:
+                self.embeddings.popitem(last=False)
+
+    def get_prefetched(self, text: str):
+        with self.lock:
+            embedding = self.embeddings.get(text)
+            if embedding is not None:
+                self.embeddings.move_to_end(text)
+            return embedding
+
+    def embed(self, text: str, **kwargs: Any) -> list[float]:
+        embedding = self.get_prefetched(text)
+        if embedding is not None:
+            return embedding
+        return self.text_embedder.embed(text, **kwargs)
+
+    async def aembed(self, text: str, **kwargs: Any) -> list[float]:
+        embedding = self.get_prefetched(text)
+        if embedding is not None:
+            return embedding
+        return await self.text_embedder.aembed(text, **kwargs)
+
+
+class PrefetchVectorStore:
+    """Wraps a vector store so the searches of a batch of queries run as one multi-vector search.
+
+    graphrag's context builders search one query at a time through `similarity_search_by_text`,
+    prefetched (query, k) results are served from memory and everything else goes to the wrapped store.
+    A prefetched result is served once, and `clear` drops what a batch left unused, so a later
+    re-sync of the store is never hidden behind old results.
+    """
+
+    def __init__(self, store: Any, max_entries: int = 4096):
+        self.store = store
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.store, name)
+
+    def prefetch(self, texts: list[str], text_embedder: Any, k: int):
+        with self.lock:
+            pending = [text for text in dict.fromkeys(texts) if (text, k) not in self.results]
+        if len(pending) == 0:
+            return
+
+        # the embedder has usually prefetched these already
+        embeddings = [text_embedder.embed(text) for text in pending]
+        searched = [(text, embedding) for text, embedding in zip(pending, embeddings) if embedding]
+        results = similarity_search_by_vectors(self.store, [embedding for _, embedding in searched], k)
+        with self.lock:
+            for (text, _), text_results in zip(searched, results):
+                self.results[(text, k)] = text_results
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+
+    def get_prefetched(self, text: str, k: int):
+        with self.lock:
+            return self.results.pop((text, k), None)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+
+    def similarity_search_by_text(self, text: str, text_embedder: Any, k: int = 10, **kwargs: Any):
+        # prefetched results were searched without any filter
+        if not kwargs and not getattr(self.store, "query_filter", None):
+            results = self.get_prefetched(text, k)
+            if results is not None:
+                return results
+        return self.store.similarity_search_by_text(text, text_embedder, k, **kwargs)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from libs.common import project_path
+
+
+def get_sync_manifest_file(project_name: str, db: str):
+    """Ids and content hashes last written to a store, kept outside output/ so index rebuilds keep it."""
+    db_name = "".join(c if c.isalnum() else "_" for c in db.lower())
+    return project_path(project_name) / "vector_sync" / f"{db_name}.json"
+
+
+def document_hash(document) -> str:
+    hash_object = hashlib.sha256()
+    hash_object.update(str(document.id).encode("utf-8"))
+    hash_object.update(b"\0" + (document.text or "").encode("utf-8"))
+    hash_object.update(b"\0" + json.dumps(document.attributes, sort_keys=True, default=str).encode("utf-8"))
+    hash_object.update(b"\0" + np.asarray(document.vector, dtype=np.float32).tobytes())
+    return hash_object.hexdigest()
+
+
+def read_sync_manifest(manifest_file):
+    if not os.path.exists(manifest_file):
+        return None
+    try:
+        with open(manifest_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_sync_manifest(manifest_file, hashes: dict):
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"updated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "documents": hashes}, f)
+    os.replace(tmp_file, manifest_file)
+
+
+def sync_documents(store, documents: list, manifest_file, full: bool = False) -> dict:
+    """Bring the store in line with `documents`, writing only what changed since the last sync.
+
+    The store must offer `count_documents`, `delete_documents` and `load_documents(overwrite=False)`
+    as an upsert. Without a manifest, with `full`, or when the store does not hold what the
+    manifest says, everything is reloaded instead.
+    """
+    documents = [document for document in documents if document.vector is not None]
+    hashes = {str(document.id): document_hash(document) for document in documents}
+
+    manifest = None if full else read_sync_manifest(manifest_file)
+    if manifest is not None and store.count_documents() != len(manifest["documents"]):
+        # someone else changed the store, the diff would be wrong
+        manifest = None
+
+    started_at = time.time()
+    if manifest is None:
+        store.load_documents(documents, overwrite=True)
+        stats = {"mode": "full", "upserted": len(documents), "deleted": 0, "unchanged": 0}
+    else:
+        old_hashes = manifest["documents"]
+        changed = [document for document in documents if old_hashes.get(str(document.id)) != hashes[str(document.id)]]
+        removed = [id for id in old_hashes if id not in hashes]
+
+        if changed:
+            store.load_documents(changed, overwrite=False)
+        if removed:
+            store.delete_documents(removed)
+        stats = {
+            "mode": "incremental",
+            "upserted": len(changed),
+            "deleted": len(removed),
+            "unchanged": len(documents) - len(changed),
+        }
+
+    # only remember what the store verifiably holds, a failed write syncs again next time.
+    # search services count asynchronously, give them a moment to catch up
+    for _ in range(10):
+        stats["stored"] = store.count_documents()
+        if stats["stored"] == len(hashes):
+            break
+        time.sleep(1)
+    stats["elapsed"] = time.time() - started_at
+    stats["synced"] = stats["stored"] == len(hashes)
+    if stats["synced"]:
+        write_sync_manifest(manifest_file, hashes)
+    elif os.path.exists(manifest_file):
+        os.remove(manifest_file)
+    return stats
@@ -0,0 +1,130 @@
+"""upload_batch against a local stand-in for the AI Search documents endpoint."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchClient
+
+import libs.config as config
+from libs.azure_ai_search import AzureAISearch
+
+
+class SearchStub:
+    """Answers each index request with the next scripted (status, {id: document status}, headers)."""
+
+    def __init__(self, responses: list[tuple]):
+        self.responses = responses
+        self.requests = []
+
+    def handle(self, ids: list[str]):
+        self.requests.append(ids)
+        status, document_statuses, headers = self.responses[min(len(self.requests), len(self.responses)) - 1]
+        if status >= 400:
+            return status, {"error": {"code": "Throttled", "message": "stub"}}, headers
+        return status, {"value": [
+            {
+                "key": id,
+                "status": document_statuses.get(id, 201) < 300,
+                "statusCode": document_statuses.get(id, 201),
+                "errorMessage": None if document_statuses.get(id, 201) < 300 else "stub",
+            }
+            for id in ids
+        ]}, headers
+
+
+@pytest.fixture
+def search_stub():
+    stubs = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            status, payload, headers = stubs[0].handle([action["id"] for action in body["value"]])
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def make_store(responses: list[tuple]):
+        stubs.append(SearchStub(responses))
+        store = AzureAISearch(collection_name="entities")
+        store.db_connection = SearchClient(
+            endpoint=f"http://127.0.0.1:{server.server_port}",
+            index_name="entities",
+            credential=AzureKeyCredential("key"),
+            # every retry is upload_batch's own
+            retry_total=0,
+        )
+        return store, stubs[-1]
+
+    yield make_store
+    server.shutdown()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    monkeypatch.setattr(config, "ai_search_max_retries", 3)
+    return slept
+
+
+def make_documents(ids: list[str]):
+    return [{"id": id, "vector": [0.1, 0.2], "text": id, "attributes": "{}"} for id in ids]
+
+
+def test_partial_result_resends_only_throttled_documents(search_stub, sleeps):
+    store, stub = search_stub([
+        (207, {"b": 429, "c": 503}, {}),
+        (200, {}, {}),
+    ])
+
+    assert store.upload_batch(make_documents(["a", "b", "c", "d"])) == 4
+    assert stub.requests == [["a", "b", "c", "d"], ["b", "c"]]
+    assert len(sleeps) == 1
+
+
+def test_throttled_request_waits_for_retry_after(search_stub, sleeps):
+    store, stub = search_stub([
+        (503, {}, {"Retry-After": "7"}),
+        (200, {}, {}),
+    ])
+
+    assert store.upload_batch(make_documents(["a", "b"])) == 2
+    assert stub.requests == [["a", "b"], ["a", "b"]]
+    assert sleeps == [7.0]
+
+
+def test_throttled_documents_exhaust_retries(search_stub, sleeps):
+    store, stub = search_stub([
+        (207, {"b": 429}, {}),
+    ])
+
+    with pytest.raises(Exception, match="1 throttled documents after 4 attempts"):
+        store.upload_batch(make_documents(["a", "b"]))
+    assert stub.requests == [["a", "b"]] + [["b"]] * 3
+    assert len(sleeps) == 3
+
+
+def test_rejected_document_is_not_retried(search_stub, sleeps):
+    store, stub = search_stub([
+        (207, {"b": 400}, {}),
+    ])
+
+    with pytest.raises(Exception, match="Failed to upload 1 documents: b"):
+        store.upload_batch(make_documents(["a", "b"]))
+    assert len(stub.requests) == 1
+    assert sleeps == []
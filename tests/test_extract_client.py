@@ -0,0 +1,157 @@
+"""ExtractClient against a local mock of the Azure OpenAI chat completions endpoint."""
+import concurrent.futures
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import libs.config as config
+import libs.extract_client as extract_client_module
+from libs.extract_client import ExtractClient
+
+
+class ChatStub:
+    """Replies per prompt: `fail <status> <retry-after-ms> <times>` fails that many times first, `sleep <s>` is slow."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.finished_at = {}
+
+    def handle(self, prompt: str):
+        with self.lock:
+            self.calls[prompt] = self.calls.get(prompt, 0) + 1
+            calls = self.calls[prompt]
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            words = prompt.split()
+            if words[0] == "fail" and calls <= int(words[3]):
+                return int(words[1]), {"error": {"code": words[1], "message": "stub"}}, {"retry-after-ms": words[2]}
+            if words[0] == "sleep":
+                time.sleep(float(words[1]))
+            return 200, {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-4o",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"text of {prompt}"}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+            }, {}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.finished_at[prompt] = time.monotonic()
+
+
+@pytest.fixture
+def chat_stub(monkeypatch):
+    stub = ChatStub()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            status, payload, headers = stub.handle(body["messages"][0]["content"])
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(config, "data_azure_api_base", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(config, "data_azure_api_key", "key")
+    monkeypatch.setattr(config, "data_azure_chat_deployment_name", "gpt-4o")
+    monkeypatch.setattr(config, "data_azure_requests_per_minute", 0)
+    monkeypatch.setattr(config, "data_azure_tokens_per_minute", 0)
+    monkeypatch.setattr(config, "data_azure_concurrency", 2)
+    monkeypatch.setattr(config, "extract_max_retries", 3)
+    # token counting would fetch the tiktoken encoding
+    monkeypatch.setattr(extract_client_module, "estimate_chat_tokens", lambda messages: 100)
+
+    yield stub
+    server.shutdown()
+
+
+def chat(client: ExtractClient, prompt: str):
+    completion = client.chat_completion(messages=[{"role": "user", "content": prompt}], model="gpt-4o")
+    return completion.choices[0].message.content
+
+
+def test_throttled_request_waits_retry_after_and_pauses_deployment(chat_stub):
+    client = ExtractClient()
+
+    started_at = time.monotonic()
+    assert chat(client, "fail 429 300 2") == "text of fail 429 300 2"
+    assert chat_stub.calls["fail 429 300 2"] == 3
+    assert time.monotonic() - started_at >= 0.6
+
+
+def test_requests_stay_within_concurrency(chat_stub):
+    client = ExtractClient()
+
+    prompts = [f"sleep 0.2 page {page}" for page in range(6)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(lambda prompt: chat(client, prompt), prompts))
+
+    assert results == [f"text of {prompt}" for prompt in prompts]
+    assert chat_stub.max_in_flight == 2
+
+
+def test_backoff_does_not_hold_a_concurrency_slot(chat_stub, monkeypatch):
+    monkeypatch.setattr(config, "data_azure_concurrency", 1)
+    client = ExtractClient()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        failing = executor.submit(chat, client, "fail 503 1000 1")
+        time.sleep(0.2)
+        healthy = executor.submit(chat, client, "sleep 0 healthy")
+        assert healthy.result(timeout=0.7) == "text of sleep 0 healthy"
+        assert failing.result() == "text of fail 503 1000 1"
+
+    assert chat_stub.finished_at["sleep 0 healthy"] < chat_stub.finished_at["fail 503 1000 1"]
+
+
+def test_waiting_for_rate_budget_does_not_hold_a_concurrency_slot(chat_stub, monkeypatch):
+    monkeypatch.setattr(config, "data_azure_concurrency", 1)
+    monkeypatch.setattr(config, "data_azure_tokens_per_minute", 600)
+    monkeypatch.setattr(extract_client_module, "estimate_chat_tokens", lambda messages: 30 if "big" in messages[0]["content"] else 1)
+    client = ExtractClient()
+    chat(client, "sleep 0 warm up")
+    # 10 tokens a second from here, the big request waits 3s for its 30
+    client.get_budget("gpt-4o").tokens = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        big = executor.submit(chat, client, "sleep 0 big")
+        time.sleep(0.2)
+        small = executor.submit(chat, client, "sleep 0 small")
+        assert small.result(timeout=1) == "text of sleep 0 small"
+        assert big.result() == "text of sleep 0 big"
+
+
+def test_retries_run_out(chat_stub):
+    client = ExtractClient()
+
+    with pytest.raises(Exception):
+        chat(client, "fail 500 0 9")
+    assert chat_stub.calls["fail 500 0 9"] == config.extract_max_retries + 1
+
+
+def test_bad_request_is_not_retried(chat_stub):
+    client = ExtractClient()
+
+    with pytest.raises(Exception):
+        chat(client, "fail 400 0 9")
+    assert chat_stub.calls["fail 400 0 9"] == 1
@@ -0,0 +1,87 @@
+"""Filtered searches on an indexed pgvector collection, against the postgres in TEST_POSTGRES_HOST."""
+import os
+
+import numpy as np
+import pytest
+from graphrag.vector_stores.base import VectorStoreDocument
+
+from libs.pgvector import PgVectorStore
+
+pytestmark = pytest.mark.skipif(not os.getenv("TEST_POSTGRES_HOST"), reason="TEST_POSTGRES_HOST is not set")
+
+rows = 2000
+dimension = 16
+groups = 20
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    return np.random.default_rng(0).standard_normal((rows, dimension)).astype(np.float32)
+
+
+@pytest.fixture(scope="module", params=["hnsw", "ivfflat"])
+def store(request, vectors):
+    store = PgVectorStore(collection_name=f"pytest_entity_embeddings_{request.param}")
+    store.connect(
+        host=os.getenv("TEST_POSTGRES_HOST"),
+        port=os.getenv("TEST_POSTGRES_PORT", "5432"),
+        dbname=os.getenv("TEST_POSTGRES_DB", "postgres"),
+        user=os.getenv("TEST_POSTGRES_USER", "postgres"),
+        password=os.getenv("TEST_POSTGRES_PASSWORD", ""),
+        vector_dimension=dimension,
+        index_type=request.param,
+        # few candidates per scan, an unfiltered index scan sees only a sliver of each group
+        hnsw_ef_search=10,
+        ivfflat_lists=40,
+        ivfflat_probes=1,
+    )
+    store.load_documents([
+        VectorStoreDocument(id=f"e{row}", text=f"entity {row}", vector=vectors[row].tolist(), attributes={"group": row % groups})
+        for row in range(rows)
+    ])
+    with store.cursor() as cur:
+        assert store.vector_index_exists(cur)
+    yield store
+    store.drop_pg_table()
+
+
+def nearest(vectors, query, candidates, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    distances = 1 - normalized[candidates] @ (query / np.linalg.norm(query))
+    return [f"e{candidates[index]}" for index in np.argsort(distances)[:k]]
+
+
+def ids(results):
+    return [result.document.id for result in results]
+
+
+def test_attribute_filtered_search_returns_k_rows(store, vectors):
+    query = np.random.default_rng(1).standard_normal(dimension).astype(np.float32)
+    store.filter_by_id([])
+    results = store.similarity_search_by_vector(query.tolist(), k=10, attributes_filter={"group": 3})
+
+    assert len(results) == 10
+    assert all(result.document.attributes["group"] == 3 for result in results)
+    if not store.iterative_scan:
+        assert ids(results) == nearest(vectors, query, np.arange(3, rows, groups), 10)
+
+
+def test_id_filtered_search_returns_k_rows(store, vectors):
+    query = np.random.default_rng(2).standard_normal(dimension).astype(np.float32)
+    candidates = np.arange(0, rows, 97)
+    store.filter_by_id([f"e{row}" for row in candidates])
+    try:
+        results = store.similarity_search_by_vectors([query.tolist(), (-query).tolist()], k=10)
+    finally:
+        store.filter_by_id([])
+
+    assert ids(results[0]) == nearest(vectors, query, candidates, 10)
+    assert ids(results[1]) == nearest(vectors, -query, candidates, 10)
+
+
+def test_search_beyond_max_ef_search(store):
+    if store.index_type != "hnsw":
+        pytest.skip("ef_search only bounds hnsw")
+    query = np.random.default_rng(3).standard_normal(dimension)
+    store.filter_by_id([])
+    assert len(store.similarity_search_by_vector(query.tolist(), k=1200)) == 1200
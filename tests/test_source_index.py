@@ -0,0 +1,66 @@
+"""Text unit -> page lookups through the page line index."""
+import sqlite3
+
+import pytest
+
+import libs.source_index as source_index
+from libs.source_index import SOURCE_INDEX_FILE, find_source_pages, index_page, remove_pdf_pages
+
+pages = {
+    "a.pdf_page_1.png.txt": "Title A\nfirst line of page one\nsecond line of page one\nlast line of page one",
+    "a.pdf_page_2.png.txt": "second line of page one\nfirst line of page two\nlast line of page two",
+    "b.pdf_page_1.png.txt": "Title B\nfirst line of page one\nsecond line of page one\nclosing line",
+}
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    monkeypatch.setattr(source_index, "get_pdf_cache_dir", lambda project_name: str(tmp_path))
+    for txt_file, text in pages.items():
+        (tmp_path / txt_file).write_text(text, encoding="utf-8")
+        index_page("project", str(tmp_path / txt_file), text)
+    return tmp_path
+
+
+def test_finds_every_page_containing_a_text_unit(project):
+    # starts and ends mid-line, only the middle lines are whole
+    text = "line of page one\nsecond line of page one\nlast line"
+    assert find_source_pages("project", [text]) == {text: [("a.pdf", "a.pdf_page_1.png", 1)]}
+
+    text = "e of page one\nsecond line of page one\nclos"
+    assert find_source_pages("project", [text])[text] == [("b.pdf", "b.pdf_page_1.png", 1)]
+
+    # shares the anchor line with page 2, but is not on it
+    text = "x\nsecond line of page one\nfirst line of page one"
+    assert find_source_pages("project", [text])[text] == []
+
+
+def test_short_texts_search_every_page(project):
+    assert find_source_pages("project", ["line of page two"])["line of page two"] == [("a.pdf", "a.pdf_page_2.png", 2)]
+
+
+def test_rewritten_and_removed_pages_update_lookups(project):
+    text = "x\nfirst line of page two\ny"
+    assert find_source_pages("project", [text])[text] == []
+
+    text = "\nfirst line of page two\n"
+    assert find_source_pages("project", [text])[text] == [("a.pdf", "a.pdf_page_2.png", 2)]
+
+    index_page("project", str(project / "b.pdf_page_1.png.txt"), "Title B\nfirst line of page two\n")
+    assert find_source_pages("project", [text])[text] == [("a.pdf", "a.pdf_page_2.png", 2), ("b.pdf", "b.pdf_page_1.png", 1)]
+
+    assert remove_pdf_pages("project", "a.pdf") == 2
+    assert find_source_pages("project", [text])[text] == [("b.pdf", "b.pdf_page_1.png", 1)]
+
+
+def test_indexes_from_before_the_line_index_are_migrated(tmp_path, monkeypatch):
+    monkeypatch.setattr(source_index, "get_pdf_cache_dir", lambda project_name: str(tmp_path))
+    conn = sqlite3.connect(tmp_path / SOURCE_INDEX_FILE)
+    conn.execute("CREATE TABLE pages (txt_file TEXT PRIMARY KEY, pdf_file TEXT, screenshot_file TEXT, page_number INTEGER, mtime_ns INTEGER, text TEXT);")
+    conn.execute("CREATE TABLE sources (text_hash TEXT PRIMARY KEY, pages TEXT);")
+    conn.execute("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?);", ("a.pdf_page_1.png.txt", "a.pdf", "a.pdf_page_1.png", 1, 0, pages["a.pdf_page_1.png.txt"]))
+    conn.commit()
+    conn.close()
+
+    text = "A\nfirst line of page one\nsec"
+    assert find_source_pages("project", [text])[text] == [("a.pdf", "a.pdf_page_1.png", 1)]
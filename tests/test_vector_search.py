@@ -0,0 +1,88 @@
+"""Batched entity search of the query path over the Local NumPy store."""
+import numpy as np
+from graphrag.vector_stores.base import VectorStoreDocument
+
+from libs.npvector import NpVectorStore
+from libs.vector_search import PrefetchVectorStore
+
+
+class TextEmbedder:
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.calls = 0
+
+    def embed(self, text: str):
+        self.calls += 1
+        return np.random.default_rng(abs(hash(text)) % 2 ** 32).standard_normal(self.dimension).tolist()
+
+
+class CountingStore(NpVectorStore):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batch_searches = 0
+
+    def similarity_search_by_vectors(self, query_embeddings, k=10, **kwargs):
+        self.batch_searches += 1
+        return super().similarity_search_by_vectors(query_embeddings, k, **kwargs)
+
+
+def make_store(tmp_path, rows: int = 200, dimension: int = 16):
+    store = CountingStore(collection_name="entities")
+    store.connect(db_uri=str(tmp_path))
+    vectors = np.random.default_rng(0).standard_normal((rows, dimension))
+    store.load_documents([
+        VectorStoreDocument(id=f"e{row}", text=f"entity {row}", vector=vectors[row].tolist(), attributes={"title": f"E{row}"})
+        for row in range(rows)
+    ])
+    return store
+
+
+def ids(results):
+    return [result.document.id for result in results]
+
+
+def test_prefetched_searches_match_single_searches(tmp_path):
+    store = make_store(tmp_path)
+    embedder = TextEmbedder(16)
+    queries = [f"query {index}" for index in range(5)]
+    expected = {query: ids(store.similarity_search_by_text(query, embedder.embed, k=20)) for query in queries}
+
+    prefetch_store = PrefetchVectorStore(store)
+    store.batch_searches = 0
+    prefetch_store.prefetch(queries, embedder, k=20)
+    assert store.batch_searches == 1
+
+    for query in queries:
+        assert ids(prefetch_store.similarity_search_by_text(query, embedder.embed, k=20)) == expected[query]
+    # served from memory, not searched again one by one
+    assert store.batch_searches == 1
+
+
+def test_filtered_search_skips_prefetched_results(tmp_path):
+    store = make_store(tmp_path)
+    embedder = TextEmbedder(16)
+    prefetch_store = PrefetchVectorStore(store)
+    prefetch_store.prefetch(["query"], embedder, k=10)
+
+    prefetch_store.filter_by_id(["e1", "e2", "e3"])
+    assert set(ids(prefetch_store.similarity_search_by_text("query", embedder.embed, k=10))) == {"e1", "e2", "e3"}
+
+    prefetch_store.filter_by_id([])
+    assert len(prefetch_store.similarity_search_by_text("query", embedder.embed, k=5)) == 5
+
+
+def test_prefetched_results_do_not_outlive_the_batch(tmp_path):
+    store = make_store(tmp_path)
+    embedder = TextEmbedder(16)
+    prefetch_store = PrefetchVectorStore(store)
+    prefetch_store.prefetch(["query", "unused"], embedder, k=10)
+    first = ids(prefetch_store.similarity_search_by_text("query", embedder.embed, k=10))
+
+    # a re-sync after the batch is seen by the next search of the same query
+    store.delete_documents(first[:1])
+    assert first[0] not in ids(prefetch_store.similarity_search_by_text("query", embedder.embed, k=10))
+
+    # the caller clears what the batch did not use
+    assert list(prefetch_store.results) == [("unused", 10)]
+    prefetch_store.clear()
+    assert len(prefetch_store.results) == 0